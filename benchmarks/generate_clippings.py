@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+
+import argparse, datetime, random, sys
+
+WORDS = [
+	'the', 'of', 'and', 'to', 'in', 'is', 'that', 'it', 'as', 'was', 'for', 'on', 'are', 'with', 'they', 'be', 'at', 'one',
+	'have', 'this', 'from', 'by', 'not', 'but', 'what', 'all', 'were', 'when', 'we', 'there', 'can', 'an', 'which', 'their',
+	'said', 'if', 'do', 'will', 'each', 'about', 'how', 'up', 'out', 'them', 'then', 'she', 'many', 'some', 'so', 'these',
+	'would', 'other', 'into', 'has', 'more', 'her', 'two', 'like', 'him', 'see', 'time', 'could', 'no', 'make', 'than',
+	'first', 'been', 'its', 'who', 'now', 'people', 'my', 'made', 'over', 'did', 'down', 'only', 'way', 'find', 'use',
+	'may', 'water', 'long', 'little', 'very', 'after', 'words', 'called', 'just', 'where', 'most', 'know', 'point',
+	'history', 'language', 'reason', 'theory', 'evidence', 'argument', 'chapter', 'example', "doesn't", '(see', 'above)',
+	'e.g.', '—', 'naïve', 'café', 'über', 'Ångström'
+]
+NAMES = ['Smith', 'Müller', 'García', 'Tanaka', 'Nguyen', 'Okafor', 'Rossi', 'Kowalski', 'Dubois', 'Andersen', 'Silva', 'Cohen']
+
+def parse_arguments():
+	arg_parser = argparse.ArgumentParser(description='chokitto - synthetic clippings generator')
+	arg_parser.add_argument('-o', '--output', help='path to output clippings file (default: STDOUT)')
+	arg_parser.add_argument('-d', '--documents', type=int, default=20, help='number of documents (default: 20)')
+	arg_parser.add_argument('-c', '--clippings', type=int, default=500, help='number of clippings per document (default: 500)')
+	arg_parser.add_argument('-r', '--reedit-rate', type=float, default=0.3, help='probability of a highlight being re-edited with a changed span (default: 0.3)')
+	arg_parser.add_argument('-n', '--note-rate', type=float, default=0.2, help='probability of a note being attached to a highlight (default: 0.2)')
+	arg_parser.add_argument('-b', '--bookmark-rate', type=float, default=0.05, help='probability of a clipping being a bookmark (default: 0.05)')
+	arg_parser.add_argument('--pdf-rate', type=float, default=0.25, help='fraction of documents which are PDFs with page-only positions (default: 0.25)')
+	arg_parser.add_argument('--seed', type=int, default=42, help='random seed (default: 42)')
+	return arg_parser.parse_args()
+
+def format_datetime(date_time):
+	# e.g. 'Added on Wednesday, January 1, 2020 9:41:53 AM'
+	hour = date_time.hour % 12 or 12
+	return 'Added on %s, %s %d, %d %d:%02d:%02d %s' % (
+		date_time.strftime('%A'), date_time.strftime('%B'), date_time.day, date_time.year,
+		hour, date_time.minute, date_time.second, 'AM' if date_time.hour < 12 else 'PM'
+	)
+
+def format_clipping(document, clip_type, page, location, date_time, content):
+	'''Formats a clipping as in Kindle's 'My Clippings.txt'.'''
+	# header line with title and optional author
+	header = '%s (%s)' % (document['title'], document['author']) if document['author'] else document['title']
+	# metadata line with positions which depend on the document format
+	positions = []
+	if document['pages']:
+		positions.append('page %d' % page[0] if page[0] == page[1] else 'page %d-%d' % page)
+	if not document['pdf']:
+		positions.append('Location %d' % location[0] if location[0] == location[1] else 'Location %d-%d' % location)
+	metadata = '- Your %s on %s | %s' % (clip_type, ' | '.join(positions), format_datetime(date_time))
+	# Kindle prefixes some headers with a byte order mark
+	bom = '﻿' if document['bom'] else ''
+	return f'{bom}{header}\r\n{metadata}\r\n\r\n{content}\r\n==========\r\n'
+
+def generate_document_clippings(document, num_clippings, reedit_rate, note_rate, bookmark_rate, rng):
+	'''Generates the clippings of a document, which is read from beginning to end over multiple sessions.
+
+	Returns:
+		list: [(datetime, 'clipping'), ...]
+	'''
+	clippings = []
+	date_time = datetime.datetime(2020, 1, 1) + datetime.timedelta(seconds=rng.randint(0, 180 * 24 * 3600))
+	location = rng.randint(1, 100)
+	while len(clippings) < num_clippings:
+		# continue reading (with occasional breaks between sessions)
+		location += rng.randint(1, 60)
+		date_time += datetime.timedelta(seconds=rng.randint(30, 900) if rng.random() > 0.05 else rng.randint(3600, 7 * 24 * 3600))
+		page = location // 16 + 1
+
+		if rng.random() < bookmark_rate:
+			clippings.append((date_time, format_clipping(document, 'Bookmark', (page, page), (location, location), date_time, '')))
+			continue
+
+		length = rng.randint(0, 6)
+		words = [rng.choice(WORDS) for _ in range(rng.randint(4, 60))]
+		clippings.append((date_time, format_clipping(document, 'Highlight', (page, (location + length) // 16 + 1), (location, location + length), date_time, ' '.join(words).capitalize() + '.')))
+		# re-edit the highlight by extending its span and content
+		while (rng.random() < reedit_rate) and (len(clippings) < num_clippings):
+			length += rng.randint(1, 3)
+			words += [rng.choice(WORDS) for _ in range(rng.randint(1, 10))]
+			date_time += datetime.timedelta(seconds=rng.randint(1, 60))
+			clippings.append((date_time, format_clipping(document, 'Highlight', (page, (location + length) // 16 + 1), (location, location + length), date_time, ' '.join(words).capitalize() + '.')))
+		# attach a note to the end of the highlight
+		if (rng.random() < note_rate) and (len(clippings) < num_clippings):
+			date_time += datetime.timedelta(seconds=rng.randint(5, 120))
+			note_page = (location + length) // 16 + 1
+			note = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 25)))
+			clippings.append((date_time, format_clipping(document, 'Note', (note_page, note_page), (location + length, location + length), date_time, note)))
+	return clippings
+
+def generate_clippings(num_documents=20, clippings_per_document=500, reedit_rate=0.3, note_rate=0.2, bookmark_rate=0.05, pdf_rate=0.25, seed=42):
+	'''Generates the contents of a synthetic clippings file.
+
+	Documents are eBooks (with or without page numbers) or PDFs (pages only) with optional authors.
+	Their clippings are interleaved chronologically, as if multiple documents were read in parallel.
+
+	Returns:
+		str: clippings file contents
+	'''
+	rng = random.Random(seed)
+	documents = []
+	for doc_idx in range(num_documents):
+		pdf = rng.random() < pdf_rate
+		documents.append({
+			'title': ('paper_%d_%s' % (doc_idx, rng.choice(WORDS).strip('().'))) if pdf else ('%s %s (Volume %d)' % (rng.choice(WORDS).capitalize(), rng.choice(WORDS), doc_idx)),
+			'author': None if pdf or (rng.random() < 0.1) else '%s, %s' % (rng.choice(NAMES), rng.choice(NAMES)),
+			'pdf': pdf,
+			'pages': pdf or (rng.random() < 0.5),
+			'bom': rng.random() < 0.5
+		})
+
+	clippings = []
+	for document in documents:
+		clippings += generate_document_clippings(document, clippings_per_document, reedit_rate, note_rate, bookmark_rate, rng)
+	# order clippings by the time they were added (stable for equal times)
+	clippings.sort(key=lambda clipping: clipping[0])
+	return ''.join(clipping for _, clipping in clippings)
+
+def main():
+	args = parse_arguments()
+	clippings = generate_clippings(
+		num_documents=args.documents, clippings_per_document=args.clippings,
+		reedit_rate=args.reedit_rate, note_rate=args.note_rate, bookmark_rate=args.bookmark_rate,
+		pdf_rate=args.pdf_rate, seed=args.seed
+	)
+	if args.output:
+		with open(args.output, 'w', encoding='utf8', newline='') as file:
+			file.write(clippings)
+	else:
+		sys.stdout.buffer.write(clippings.encode('utf8'))
+
+if __name__ == '__main__':
+	main()
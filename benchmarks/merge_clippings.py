@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+
+import argparse, copy, datetime, json, random, time
+
+from collections import defaultdict
+
+from lib.data import *
+
+def parse_arguments():
+	arg_parser = argparse.ArgumentParser(description='chokitto - merge_clippings benchmark')
+	arg_parser.add_argument('-s', '--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='numbers of clippings per synthetic document (default: 1000 10000 100000)')
+	arg_parser.add_argument('-r', '--reedit-rate', type=float, default=0.3, help='probability of a highlight being re-edited with a changed span (default: 0.3)')
+	arg_parser.add_argument('-n', '--note-rate', type=float, default=0.2, help='probability of a note being attached to a highlight (default: 0.2)')
+	arg_parser.add_argument('--legacy-limit', type=int, default=10000, help='largest size for which the legacy implementation is run (default: 10000)')
+	arg_parser.add_argument('--seed', type=int, default=42, help='random seed (default: 42)')
+	arg_parser.add_argument('--json', action='store_true', help='print results as JSON (default: False)')
+	return arg_parser.parse_args()
+
+def generate_document(num_clippings, reedit_rate=0.3, note_rate=0.2, seed=42):
+	'''Generates a document with overlapping highlights, re-edits, notes and bookmarks sorted by location.'''
+	rng = random.Random(seed)
+	words = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit', 'sed', 'do', 'eiusmod', 'tempor']
+	clippings = []
+	date_time = datetime.datetime(2020, 1, 1)
+	location = 1
+	while len(clippings) < num_clippings:
+		location += rng.randint(0, 20)
+		date_time += datetime.timedelta(seconds=rng.randint(1, 600))
+		length = rng.randint(0, 5)
+		content = ' '.join(rng.choice(words) for _ in range(rng.randint(5, 30)))
+		if rng.random() < 0.05:
+			clippings.append(Clipping(None, (location, location), date_time, '', 'bookmark'))
+			continue
+		clippings.append(Clipping(None, (location, location + length), date_time, content, 'highlight'))
+		# re-edit the highlight by extending its span and content
+		while (rng.random() < reedit_rate) and (len(clippings) < num_clippings):
+			length += rng.randint(1, 3)
+			content += ' ' + rng.choice(words)
+			date_time += datetime.timedelta(seconds=rng.randint(1, 60))
+			clippings.append(Clipping(None, (location, location + length), date_time, content, 'highlight'))
+		# attach a note to the end of the highlight
+		if (rng.random() < note_rate) and (len(clippings) < num_clippings):
+			date_time += datetime.timedelta(seconds=rng.randint(1, 60))
+			clippings.append(Clipping(None, (location + length, location + length), date_time, rng.choice(words), 'note'))
+
+	document = Document('Synthetic Document', 'Benchmark, Chokitto')
+	for clipping in sorted(clippings[:num_clippings]):
+		document.add_clipping(clipping)
+	return document
+
+#
+# legacy implementation (before interval sweep)
+#
+
+def legacy_merge(clipping, other):
+	merged = copy.deepcopy(clipping)
+	result = clipping.merge(other)
+	merged.clip_type, merged.page, merged.location, merged.datetime, merged.content = result.clip_type, result.page, result.location, result.datetime, result.content
+	return merged
+
+def legacy_merge_clippings(document):
+	clippings = sorted(document.get_clippings())
+	del_idcs = set()
+	for clip_idx, clipping in enumerate(clippings):
+		clip_start, clip_end = clipping.get_position(prefer_location=True, as_type=int)
+		merged = False
+		merged_clipping = copy.deepcopy(clipping)
+		for next_idx in range(clip_idx + 1, len(clippings)):
+			next_clipping = clippings[next_idx]
+			next_start, next_end = next_clipping.get_position(prefer_location=True, as_type=int)
+			if next_start > clip_end:
+				break
+			if merged_clipping.subsumes(next_clipping) or next_clipping.subsumes(merged_clipping):
+				merged_clipping = legacy_merge(merged_clipping, next_clipping)
+				clip_start, clip_end = merged_clipping.get_position(prefer_location=True, as_type=int)
+				del_idcs.add(clip_idx)
+				del_idcs.add(next_idx)
+				merged = True
+		if merged:
+			document.add_clipping(merged_clipping)
+
+	new_clippings = []
+	new_type_idx_map = defaultdict(list)
+	for clip_idx, clipping in enumerate(document.clippings):
+		if clip_idx in del_idcs:
+			continue
+		new_clippings.append(clipping)
+		new_type_idx_map[clipping.clip_type].append(len(new_clippings)-1)
+	document.clippings = new_clippings
+	document._type_idx_map = new_type_idx_map
+
+def summarize(document):
+	# order-independent summary of all clippings and their merged contents
+	return sorted(
+		repr((c.clip_type, c.page, c.location, c.datetime, [(m.clip_type, m.content) for m in c.content] if c.is_merged() else c.content))
+		for c in document.get_clippings()
+	)
+
+def main():
+	args = parse_arguments()
+
+	results = []
+	for size in args.sizes:
+		document = generate_document(size, reedit_rate=args.reedit_rate, note_rate=args.note_rate, seed=args.seed)
+		result = {'clippings': size}
+
+		current = copy.deepcopy(document)
+		start_time = time.perf_counter()
+		current.merge_clippings()
+		result['current_seconds'] = time.perf_counter() - start_time
+		result['merged_clippings'] = len(current.clippings)
+
+		if size <= args.legacy_limit:
+			legacy = copy.deepcopy(document)
+			start_time = time.perf_counter()
+			legacy_merge_clippings(legacy)
+			result['legacy_seconds'] = time.perf_counter() - start_time
+			result['speedup'] = result['legacy_seconds'] / result['current_seconds']
+			result['identical'] = summarize(current) == summarize(legacy)
+		results.append(result)
+
+	if args.json:
+		print(json.dumps(results, indent=4))
+		return
+
+	print("merge_clippings (%d sizes):" % len(results))
+	for result in results:
+		print("  %7d clippings: %.3fs current%s" % (
+			result['clippings'],
+			result['current_seconds'],
+			', %.3fs legacy (%.1fx, %s)' % (result['legacy_seconds'], result['speedup'], 'identical' if result['identical'] else 'DIFFERENT') if 'legacy_seconds' in result else ''
+		))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+
+import argparse, json, random, re, time
+
+from lib.matching import *
+
+def parse_arguments():
+	arg_parser = argparse.ArgumentParser(description='chokitto - PDF highlight matching benchmark')
+	arg_parser.add_argument('-l', '--lengths', type=int, nargs='+', default=[100, 300, 1000], help='lengths of synthetic highlights in characters (default: 100 300 1000)')
+	arg_parser.add_argument('-p', '--page-length', type=int, default=4000, help='length of the synthetic page text in characters (default: 4000)')
+	arg_parser.add_argument('-n', '--num-highlights', type=int, default=5, help='number of highlights per length (default: 5)')
+	arg_parser.add_argument('--legacy-limit', type=int, default=300, help='longest highlight for which the legacy implementation is run (default: 300)')
+	arg_parser.add_argument('--seed', type=int, default=42, help='random seed (default: 42)')
+	arg_parser.add_argument('--json', action='store_true', help='print results as JSON (default: False)')
+	return arg_parser.parse_args()
+
+def generate_page(length, rng):
+	'''Generates cleaned page text with recurring phrases, which makes short queries ambiguous.'''
+	words = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit', 'sed', 'do', 'eiusmod', 'tempor', 'incididunt', 'ut', 'labore']
+	tokens = []
+	while sum(len(token) + 1 for token in tokens) < length:
+		tokens.append(rng.choice(words))
+	return ' '.join(tokens)[:length]
+
+def generate_highlight(page_txt, length, rng):
+	'''Cuts a highlight from the page and perturbs it like a Kindle clipping (e.g. ligatures, changed quotes).'''
+	start_idx = rng.randint(0, len(page_txt) - length)
+	chars = list(page_txt[start_idx:start_idx+length])
+	for _ in range(max(1, length // 200)):
+		chars[rng.randrange(len(chars))] = 'ﬁ'
+	return ''.join(chars)
+
+#
+# legacy implementation (before suffix automaton)
+#
+
+def legacy_find(page_txt, clipping_txt, min_query_len=0):
+	query_len = len(clipping_txt)
+	matches = []
+	while query_len > min_query_len:
+		ambiguous_match = False
+		start_idx = 0
+		while (start_idx + query_len) <= len(clipping_txt):
+			cur_query = clipping_txt[start_idx:start_idx+query_len]
+			pattern = re.compile(re.escape(cur_query))
+			matches = [m for m in pattern.finditer(page_txt)]
+			if len(matches) == 1:
+				return matches[0].start() - start_idx
+			elif len(matches) > 0:
+				ambiguous_match = True
+			start_idx += 1
+		if ambiguous_match:
+			return None
+		query_len -= 1
+	return None
+
+def current_find(page_txt, clipping_txt, min_query_len=0):
+	match = SuffixAutomaton(page_txt).find_longest_unique(clipping_txt, min_len=min_query_len)
+	if match is None:
+		return None
+	return match[1] - match[0]
+
+def main():
+	args = parse_arguments()
+	rng = random.Random(args.seed)
+	page_txt = generate_page(args.page_length, rng)
+
+	results = []
+	for length in args.lengths:
+		highlights = [generate_highlight(page_txt, length, rng) for _ in range(args.num_highlights)]
+		result = {'length': length, 'highlights': len(highlights)}
+
+		start_time = time.perf_counter()
+		current = [current_find(page_txt, highlight) for highlight in highlights]
+		result['current_seconds'] = time.perf_counter() - start_time
+		result['matched'] = sum(1 for match in current if match is not None)
+
+		if length <= args.legacy_limit:
+			start_time = time.perf_counter()
+			legacy = [legacy_find(page_txt, highlight) for highlight in highlights]
+			result['legacy_seconds'] = time.perf_counter() - start_time
+			result['speedup'] = result['legacy_seconds'] / result['current_seconds']
+			result['identical'] = current == legacy
+		results.append(result)
+
+	if args.json:
+		print(json.dumps(results, indent=4))
+		return
+
+	print("pdf_matching (%d lengths, %d character page):" % (len(results), len(page_txt)))
+	for result in results:
+		print("  %5d characters: %.3fs current, %d/%d matched%s" % (
+			result['length'],
+			result['current_seconds'],
+			result['matched'], result['highlights'],
+			', %.3fs legacy (%.1fx, %s)' % (result['legacy_seconds'], result['speedup'], 'identical' if result['identical'] else 'DIFFERENT') if 'legacy_seconds' in result else ''
+		))
+
+if __name__ == '__main__':
+	main()
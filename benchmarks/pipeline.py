@@ -0,0 +1,143 @@
+#!/usr/bin/python3
+
+import argparse, collections, json, os, platform, subprocess, tempfile, time, tracemalloc
+
+from benchmarks.generate_clippings import generate_clippings
+from lib.data import *
+from lib.exporters import *
+from lib.filters import *
+from lib.parsers import *
+
+def parse_arguments():
+	arg_parser = argparse.ArgumentParser(description='chokitto - pipeline benchmark')
+	arg_parser.add_argument('-d', '--documents', type=int, default=20, help='number of synthetic documents (default: 20)')
+	arg_parser.add_argument('-c', '--clippings', type=int, default=500, help='number of clippings per synthetic document (default: 500)')
+	arg_parser.add_argument('-r', '--reedit-rate', type=float, default=0.3, help='probability of a highlight being re-edited with a changed span (default: 0.3)')
+	arg_parser.add_argument('-n', '--note-rate', type=float, default=0.2, help='probability of a note being attached to a highlight (default: 0.2)')
+	arg_parser.add_argument('-b', '--bookmark-rate', type=float, default=0.05, help='probability of a clipping being a bookmark (default: 0.05)')
+	arg_parser.add_argument('--pdf-rate', type=float, default=0.25, help='fraction of documents which are PDFs with page-only positions (default: 0.25)')
+	arg_parser.add_argument('-i', '--input', help='path to an existing clippings file instead of synthetic data (default: None)')
+	arg_parser.add_argument('-p', '--parsers', nargs='+', default=list(PARSER_MAP.keys()), choices=list(PARSER_MAP.keys()), help='parsers to benchmark (default: all)')
+	arg_parser.add_argument('-e', '--exporters', nargs='+', default=['markdown', 'json', 'jsonl'], help='exporters to benchmark (default: markdown json jsonl)')
+	arg_parser.add_argument('-f', '--filters', nargs='*', default=["after('2020-03-01 00:00:00') and (type('highlight') or type('note'))"], help='filters to benchmark (default: date and type expression)')
+	arg_parser.add_argument('--repeat', type=int, default=3, help='number of timed runs per stage, of which the fastest is reported (default: 3)')
+	arg_parser.add_argument('--seed', type=int, default=42, help='random seed (default: 42)')
+	arg_parser.add_argument('--compare', help='path to JSON results of a previous run to compare against (default: None)')
+	arg_parser.add_argument('--json', action='store_true', help='print results as JSON (default: False)')
+	return arg_parser.parse_args()
+
+def get_commit():
+	# identify the benchmarked code if run from a git repository
+	try:
+		return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def measure(function, setup=None, repeat=3):
+	'''Measures the fastest of multiple timed runs of a function and its peak memory in a separate traced run.
+
+	The optional setup function prepares fresh arguments for each run and is not measured.
+
+	Returns:
+		dict: {'seconds': float, 'peak_bytes': int}
+	'''
+	times = []
+	for _ in range(repeat):
+		args = setup() if setup else tuple()
+		start_time = time.perf_counter()
+		function(*args)
+		times.append(time.perf_counter() - start_time)
+	# tracing slows down execution, so memory is measured separately
+	args = setup() if setup else tuple()
+	tracemalloc.start()
+	function(*args)
+	_, peak_bytes = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return {'seconds': min(times), 'peak_bytes': peak_bytes}
+
+def merge_documents(documents):
+	for document in documents.values():
+		document.merge_clippings()
+		document.deduplicate_clippings()
+
+def export_documents(exporter, documents):
+	with open(os.devnull, 'w', encoding='utf8') as file:
+		exporter.dump(documents, file)
+
+def run_stages(path, args):
+	'''Runs and measures each stage of the pipeline on a clippings file.
+
+	Returns:
+		dict: {'stage': {'seconds': float, 'peak_bytes': int, 'clippings_per_second': float}, ...}
+	'''
+	default_parser = PARSER_MAP[args.parsers[0]]()
+	documents = default_parser.parse(path)
+	num_clippings = sum(len(document.clippings) for document in documents.values())
+	filters = parse_filters(args.filters) if args.filters else []
+
+	stages = collections.OrderedDict()
+	for parser_name in args.parsers:
+		parser = PARSER_MAP[parser_name]()
+		stages[f'parse:{parser_name}'] = measure(lambda: parser.parse(path), repeat=args.repeat)
+	stages['stream'] = measure(lambda: collections.deque(default_parser.iter_clippings(path), maxlen=0), repeat=args.repeat)
+	stages['merge'] = measure(merge_documents, setup=lambda: (default_parser.parse(path), ), repeat=args.repeat)
+	if filters:
+		stages['filter'] = measure(lambda: apply_filters(documents, filters), repeat=args.repeat)
+	for exporter_str in args.exporters:
+		exporter = parse_exporter(exporter_str)
+		stages[f'export:{exporter_str}'] = measure(lambda: export_documents(exporter, documents), repeat=args.repeat)
+
+	for stage in stages.values():
+		stage['clippings_per_second'] = num_clippings / stage['seconds'] if stage['seconds'] > 0 else None
+	return num_clippings, len(documents), stages
+
+def main():
+	args = parse_arguments()
+
+	# generate synthetic clippings file (if none is provided)
+	path = args.input
+	if path is None:
+		clippings = generate_clippings(
+			num_documents=args.documents, clippings_per_document=args.clippings,
+			reedit_rate=args.reedit_rate, note_rate=args.note_rate, bookmark_rate=args.bookmark_rate,
+			pdf_rate=args.pdf_rate, seed=args.seed
+		)
+		with tempfile.NamedTemporaryFile('w', suffix='.txt', encoding='utf8', newline='', delete=False) as file:
+			file.write(clippings)
+			path = file.name
+	try:
+		num_clippings, num_documents, stages = run_stages(path, args)
+		num_bytes = os.path.getsize(path)
+	finally:
+		if args.input is None:
+			os.remove(path)
+
+	results = {
+		'commit': get_commit(),
+		'python': platform.python_version(),
+		'config': {k: v for k, v in vars(args).items() if k not in ('compare', 'json')},
+		'bytes': num_bytes,
+		'documents': num_documents,
+		'clippings': num_clippings,
+		'stages': stages
+	}
+	baseline = None
+	if args.compare:
+		with open(args.compare, 'r', encoding='utf8') as file:
+			baseline = json.load(file)
+
+	if args.json:
+		print(json.dumps(results, indent=4))
+		return
+
+	print("pipeline (%d documents, %d clippings, %.1f MB%s):" % (num_documents, num_clippings, num_bytes / (1 << 20), ', commit %s' % results['commit'] if results['commit'] else ''))
+	for stage_name, stage in stages.items():
+		comparison = ''
+		if baseline and (stage_name in baseline['stages']):
+			comparison = ', %.2fx vs. %s' % (baseline['stages'][stage_name]['seconds'] / stage['seconds'], baseline['commit'] or args.compare)
+		print("  %-18s %8.3fs %10.0f clippings/s %8.1f MB peak%s" % (
+			stage_name, stage['seconds'], stage['clippings_per_second'] or 0, stage['peak_bytes'] / (1 << 20), comparison
+		))
+
+if __name__ == '__main__':
+	main()
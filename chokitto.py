@@ -1,24 +1,33 @@
 #!/usr/bin/python3
 
-import argparse, os
+import argparse, os, sys
 
 from collections import defaultdict
 
-from lib.data import *
-from lib.exporters import *
-from lib.filters import *
 from lib.parsers import *
+from lib.pipeline import *
+from lib.profiling import *
 
 def parse_arguments():
     arg_parser = argparse.ArgumentParser(description='chokitto')
-    arg_parser.add_argument('input', help='path to clippings file')
-    arg_parser.add_argument('-o', '--output', help='path to output file (default: STDOUT)')
+    arg_parser.add_argument('input', nargs='+', help='paths to clippings files or directories containing them (e.g. from multiple devices)')
+    arg_parser.add_argument('-o', '--output', help='path to output file or directory (default: STDOUT)')
+    arg_parser.add_argument('-d', '--output-dir', help='path to output directory with one file per document (default: None)')
     arg_parser.add_argument('-p', '--parser', default='kindle', choices=list(PARSER_MAP.keys()), help='parser for clippings file (default: kindle)')
+    arg_parser.add_argument('-c', '--checkpoint', help='path to checkpoint file for incrementally parsing appended clippings (default: None)')
+    arg_parser.add_argument('-j', '--jobs', type=int, default=1, help='number of processes used to parse large clippings files (default: 1)')
+    arg_parser.add_argument('-i', '--index', action='store_true', help='build and use an inverted index of clipping contents for content filters, stored as "<input>.index" (default: False)')
     arg_parser.add_argument('-e', '--exporter', default='markdown', help='clipping exporter (default: markdown)')
+    arg_parser.add_argument('--dedup', action='store_true', help='remove clippings with the same type, position and content, keeping the newest (default: False)')
     arg_parser.add_argument('-m', '--merge', action='store_true', help='merge clippings of different types if they occur at the same location (default: False)')
     arg_parser.add_argument('-f', '--filters', nargs='*', help='list of filters to apply (default: None, format: "filter(\'arg\',\'arg\')")')
     arg_parser.add_argument('-ls', '--list', action='store_true', help='list titles of documents in clippings file and exit (default: False)')
+    arg_parser.add_argument('-w', '--watch', action='store_true', help='watch the clippings file and re-export changed documents to the output directory until interrupted (default: False)')
+    arg_parser.add_argument('--interval', type=float, default=1., help='seconds between checking the watched clippings file for changes (default: 1.0)')
     arg_parser.add_argument('-v', '--verbose', action='store_true', help='set verbosity (default: False)')
+    arg_parser.add_argument('--profile', action='store_true', help='print time, memory blocks and item counts of each stage and of instrumented functions (default: False)')
+    arg_parser.add_argument('--profile-memory', action='store_true', help='additionally trace the peak memory of each stage, which slows down profiled stages (default: False)')
+    arg_parser.add_argument('--pstats', help='path to write cProfile statistics to (default: None)')
     return arg_parser.parse_args()
 
 def get_user_input(prompt, options=['y', 'n']):
@@ -27,50 +36,71 @@ def get_user_input(prompt, options=['y', 'n']):
 		ans = input(f"{prompt} [{'/'.join(options)}] ")
 	return ans
 
-def main():
-	args = parse_arguments()
+def run(args, profiler):
+	pipeline = Pipeline(
+		parser=args.parser, exporter=args.exporter, filters=args.filters, dedup=args.dedup, merge=args.merge,
+		index=args.index, jobs=args.jobs, verbose=args.verbose, profiler=profiler
+	)
 
-	# parse clippings
-	parser = PARSER_MAP[args.parser](verbose=args.verbose)
-	documents = parser.parse(args.input)
+	# collect clippings files (identical clippings in multiple files are only added once)
+	paths = collect_clippings_paths(args.input)
+	assert (args.checkpoint is None) or (len(paths) == 1), "[Error] Checkpoints can only be used with a single clippings file."
+	path = paths[0] if len(paths) == 1 else paths
 
-	# merge and deduplicate clippings
-	if args.merge:
-		for title, author in documents:
-			documents[(title, author)].merge_clippings()
-			documents[(title, author)].deduplicate_clippings()
+	# check the output before parsing
+	if not args.list:
+		pipeline.check_output(args.output, output_dir=args.output_dir)
 
-	# set up filters
-	filters = parse_filters(args.filters) if args.filters else []
-	if filters:
-		# print filters
-		if args.verbose:
-			print("Filters (%d total):" % len(filters))
-			for filt in filters:
-				print("  %s" % filt)
-		# apply filters
-		documents = apply_filters(documents, filters)
+	# watch the clippings file and export changed documents
+	if args.watch:
+		assert args.output_dir is not None, "[Error] Watching requires an output directory (-d)."
+		assert isinstance(path, str), "[Error] Only a single clippings file can be watched."
+		try:
+			pipeline.watch(path, args.output_dir, interval=args.interval)
+		except KeyboardInterrupt:
+			pass
+		return
+
+	# stream clippings from the parser through the filters into the exporter if no documents need to be held
+	doc_keys = []
+	if pipeline.can_stream(checkpoint=args.checkpoint) and not (args.list or args.output_dir):
+		source = pipeline.iter_clippings(path, doc_keys=doc_keys)
+	else:
+		source = pipeline.get_documents(path, checkpoint=args.checkpoint, doc_keys=doc_keys)
 
-	# list documents (and exit if list flag was used)
-	if args.verbose or args.list:
-		print("Documents (%d total):" % len(documents))
-		for title, author in sorted(documents):
-			print("  %s" % documents[(title, author)])
-		if args.list: return
+		# list documents (and exit if list flag was used)
+		if args.verbose or args.list:
+			print("Documents (%d total):" % len(source))
+			for title, author in sorted(source):
+				print("  %s" % source[(title, author)])
+			if args.list: return
 
-	# set up exporter
-	exporter = parse_exporter(args.exporter)
-	if args.output:
-		# check if file already exists
-		if os.path.exists(args.output):
+	if args.output_dir:
+		# export each document to its own file
+		output_paths, removed_paths = pipeline.export_documents(source, args.output_dir, doc_keys=doc_keys)
+		if args.verbose: print(f"Output:\n  Output was saved to {len(output_paths)} changed files (of {len(source)} documents) in '{args.output_dir}' using {pipeline.exporter}, {len(removed_paths)} outdated files were removed.")
+	elif args.output:
+		# check if file already exists (directories receive multiple output files, databases are updated)
+		if os.path.exists(args.output) and not os.path.isdir(args.output) and pipeline.exporter.overwrites:
 			ans = get_user_input(f"File '{args.output}' already exists. Overwrite?")
 			if ans == 'n':
 				return
-		exporter.write(documents, args.output)
-		if args.verbose: print(f"Output:\n  Output was saved to '{args.output}' using {exporter}.")
+		pipeline.export(source, args.output, doc_keys=doc_keys)
+		if args.verbose: print(f"Output:\n  Output was saved to '{args.output}' using {pipeline.exporter}.")
 	else:
 		if args.verbose: print("Output:\n")
-		print(exporter(documents))
+		pipeline.export(source, sys.stdout, doc_keys=doc_keys)
+		if not pipeline.exporter.line_terminated:
+			print()
+
+def main():
+	args = parse_arguments()
+
+	profiler = Profiler(enabled=(args.profile or args.profile_memory or args.pstats is not None), pstats_path=args.pstats, trace_memory=args.profile_memory)
+	with profiler:
+		run(args, profiler)
+	if profiler.enabled:
+		print(profiler.report(), file=sys.stderr)
 
 if __name__ == '__main__':
 	main()
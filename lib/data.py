@@ -1,7 +1,126 @@
-import copy, datetime
+import bisect, datetime, hashlib
 
 from collections import defaultdict
 
+def add_to_documents(documents, doc_key, clipping):
+	# add document to dictionary if new
+	if doc_key not in documents:
+		documents[doc_key] = Document(*doc_key)
+	# add clipping to document
+	documents[doc_key].add_clipping(clipping)
+
+def collect_documents(clippings, doc_keys=None):
+	'''Groups a stream of clippings into documents.
+
+	Documents are ordered by their first clipping in the stream. If the stream was filtered, the keys of
+	all documents collected before filtering (see filter_clippings) restore the order of the unfiltered stream.
+
+	Returns:
+		dict: {('title', 'author'): Document, ...}
+	'''
+	documents = {}
+	for doc_key, clipping in clippings:
+		add_to_documents(documents, doc_key, clipping)
+	if doc_keys:
+		documents = {doc_key: documents[doc_key] for doc_key in doc_keys if doc_key in documents}
+	return documents
+
+def detach_document(document):
+	# views reference their entire underlying document, which would be transferred to worker processes along with them
+	return document.to_document() if isinstance(document, DocumentView) else document
+
+def get_clipping_fingerprint(doc_key, clipping):
+	'''Computes a stable fingerprint of a clipping from its document, type, position, datetime and content.
+
+	Identical clippings (e.g. from clippings files of multiple devices) have identical fingerprints,
+	independently of the interpreter's hash seed.
+
+	Returns:
+		bytes: 16-byte digest
+	'''
+	# merged clippings are identified by the fingerprints of their contents
+	if clipping.is_merged():
+		content = ''.join(get_clipping_fingerprint(doc_key, c).hex() for c in clipping.content)
+	else:
+		content = clipping.content
+	fields = (doc_key[0], doc_key[1], clipping.clip_type, clipping.page, clipping.location, clipping.datetime, content)
+	return hashlib.blake2b('\x1f'.join(map(str, fields)).encode('utf8'), digest_size=16).digest()
+
+def iter_unique_clippings(files_clippings, stats=None):
+	'''Skips clippings which are identical to a clipping of a previous file in a single pass over the clippings of multiple files.
+
+	Identical clippings within the same file are kept (these are removed by Document.remove_duplicate_clippings),
+	so that the clippings of a single file are the same, independently of the other files. The number of
+	skipped clippings is counted in stats['duplicate'] if a stats dict is provided.
+
+	Returns:
+		generator: (('title', 'author'), Clipping), ...
+	'''
+	fingerprints = set()
+	for clippings in files_clippings:
+		# fingerprints of the current file are only compared against the clippings of subsequent files
+		file_fingerprints = []
+		for doc_key, clipping in clippings:
+			fingerprint = get_clipping_fingerprint(doc_key, clipping)
+			if fingerprint in fingerprints:
+				if stats is not None:
+					stats['duplicate'] = stats.get('duplicate', 0) + 1
+				continue
+			file_fingerprints.append(fingerprint)
+			yield doc_key, clipping
+		fingerprints.update(file_fingerprints)
+
+
+class MinSegmentTree:
+	'''Segment tree over a list of values, which finds the first value within an index range below a bound.
+
+	Queries take O(log n) time, independently of the number of values which are skipped.
+	'''
+	def __init__(self, values):
+		self.size = 1
+		while self.size < len(values):
+			self.size *= 2
+		# leaves store the values, inner nodes the minimum of their children (node 1 is the root)
+		self.mins = [float('inf')] * (2 * self.size)
+		self.mins[self.size:self.size + len(values)] = values
+		for node in range(self.size - 1, 0, -1):
+			self.mins[node] = min(self.mins[2 * node], self.mins[2 * node + 1])
+
+	def __repr__(self):
+		return f'<MinSegmentTree: {self.size} leaves>'
+
+	def find_first(self, start, end, bound):
+		'''Finds the first index in [start, end) whose value is at most the bound.
+
+		Returns:
+			int: index or end if no value is at most the bound
+		'''
+		mins = self.mins
+		left, right = start + self.size, end + self.size
+		# nodes covering the range, collected from the left and right boundaries towards the root
+		right_nodes = []
+		while left < right:
+			if left & 1:
+				if mins[left] <= bound:
+					return self._descend(left, bound)
+				left += 1
+			if right & 1:
+				right -= 1
+				right_nodes.append(right)
+			left //= 2
+			right //= 2
+		for node in reversed(right_nodes):
+			if mins[node] <= bound:
+				return self._descend(node, bound)
+		return end
+
+	def _descend(self, node, bound):
+		# follow the leftmost child whose minimum is at most the bound down to a leaf
+		while node < self.size:
+			node = 2 * node if self.mins[2 * node] <= bound else 2 * node + 1
+		return node - self.size
+
+
 class Document:
 	def __init__(self, title, author=None):
 		self.title = title
@@ -43,41 +162,62 @@ class Document:
 		return list(self._type_idx_map.keys())
 
 	def merge_clippings(self):
-		clippings = sorted(self.get_clippings())
+		'''Merges clippings which subsume each other (e.g. re-edited highlights and notes attached to them).
+
+		Subsumption requires nested ranges. Clippings are sorted by their start, so for each clipping only
+		successors with the same start or which end within its range can be merged. Successors which
+		overlap without being nested are skipped using a segment tree over the ends of the ranges, so that
+		the time grows with the number of nested pairs instead of the number of overlapping pairs.
+		'''
+		clippings = sorted(self.get_clippings(), key=Clipping.sort_key)
+		# normalized spans, starts are sorted in the same order as the clippings
+		spans = [clipping.span for clipping in clippings]
+		starts = [span[0] for span in spans]
+		ends = MinSegmentTree([span[1] for span in spans])
 		del_idcs = set()
 		# iterate over all clippings and find overlapping entries
 		for clip_idx, clipping in enumerate(clippings):
-			clip_start, clip_end = clipping.get_position(prefer_location=True, as_type=int)
-			# initialize merged clipping as current one
+			clip_start, clip_end = spans[clip_idx]
+			# initialize merged clipping as current one (merging creates a new clipping)
 			merged = False
-			merged_clipping = copy.deepcopy(clipping)
-			# perform lookahead
-			for next_idx in range(clip_idx + 1, len(clippings)):
+			merged_clipping = clipping
+			# perform lookahead over all clippings which start within the current range
+			next_idx = clip_idx + 1
+			stop_idx = bisect.bisect_right(starts, clip_end, lo=next_idx)
+			while next_idx < stop_idx:
+				next_start, next_end = spans[next_idx]
+				# skip to the next clipping within the current range (successors starting later can't contain it)
+				if (next_start > clip_start) and (next_end > clip_end):
+					next_idx = ends.find_first(next_idx, stop_idx, clip_end)
+					if next_idx >= stop_idx:
+						break
+					next_start, next_end = spans[next_idx]
 				next_clipping = clippings[next_idx]
-				next_start, next_end = next_clipping.get_position(prefer_location=True, as_type=int)
-				# check if lookahead exceeds clipping range
-				if next_start > clip_end:
-					break
+				# subsumption requires nested ranges, so check those before comparing types and contents
+				subsumes_next = (clip_start <= next_start) and (clip_end >= next_end) and merged_clipping.subsumes(next_clipping)
 				# if clipping subsumes its successor or vice versa, merge
-				if merged_clipping.subsumes(next_clipping) or next_clipping.subsumes(merged_clipping):
+				if subsumes_next or ((next_start <= clip_start) and (next_end >= clip_end) and next_clipping.subsumes(merged_clipping)):
 					# add lookahead clipping to new, merged clipping
 					merged_clipping = merged_clipping.merge(next_clipping)
 					# update clipping range to reflect potentially larger or smaller span
-					clip_start, clip_end = merged_clipping.get_position(prefer_location=True, as_type=int)
+					clip_start, clip_end = merged_clipping.span
+					stop_idx = bisect.bisect_right(starts, clip_end, lo=next_idx + 1)
 					# add current and merged indices to deletion queue
 					del_idcs.add(clip_idx)
 					del_idcs.add(next_idx)
 					merged = True
+				next_idx += 1
 			# add merged clipping to document
 			if merged:
 				self.add_clipping(merged_clipping)
-		
-		# rebuild clippings list and remove merged entries
+
+		# rebuild clippings list and remove merged entries (indices refer to the sorted list)
+		del_ids = {id(clippings[clip_idx]) for clip_idx in del_idcs}
 		new_clippings = []
 		new_type_idx_map = defaultdict(list)
-		for clip_idx, clipping in enumerate(self.clippings):
+		for clipping in self.clippings:
 			# skip old clippings which were merged
-			if clip_idx in del_idcs:
+			if id(clipping) in del_ids:
 				continue
 			new_clippings.append(clipping)
 			new_type_idx_map[clipping.clip_type].append(len(new_clippings)-1)
@@ -85,6 +225,38 @@ class Document:
 		self.clippings = new_clippings
 		self._type_idx_map = new_type_idx_map
 
+	def remove_duplicate_clippings(self):
+		'''Removes clippings with the same type, position and content in a single pass, keeping the newest.
+
+		The newest clipping takes the place of the first duplicate. Merged clippings are kept as they are.
+
+		Returns:
+			int: number of removed clippings
+		'''
+		new_clippings = []
+		clip_idx_map = {} # {(type, page, location, content): index in new_clippings}
+		for clipping in self.clippings:
+			if clipping.is_merged():
+				new_clippings.append(clipping)
+				continue
+			clip_key = (clipping.clip_type, clipping.page, clipping.location, clipping.content)
+			# replace previous duplicate if this clipping is newer
+			if clip_key in clip_idx_map:
+				clip_idx = clip_idx_map[clip_key]
+				previous = new_clippings[clip_idx]
+				if (clipping.datetime is not None) and ((previous.datetime is None) or (clipping.datetime > previous.datetime)):
+					new_clippings[clip_idx] = clipping
+				continue
+			clip_idx_map[clip_key] = len(new_clippings)
+			new_clippings.append(clipping)
+
+		num_removed = len(self.clippings) - len(new_clippings)
+		if num_removed > 0:
+			self.del_clippings()
+			for clipping in new_clippings:
+				self.add_clipping(clipping)
+		return num_removed
+
 	def deduplicate_clippings(self):
 		for clipping in self.get_clippings():
 			if not clipping.is_merged():
@@ -92,7 +264,90 @@ class Document:
 			clipping.deduplicate()
 
 
+class DocumentView(Document):
+	'''Read-only view on a subset of a document's clippings, which are referenced by their index.
+
+	Methods which would modify the clippings raise a TypeError. Use to_document() to get a modifiable copy.
+	'''
+	def __init__(self, document, clip_idcs):
+		# views on views reference the underlying document directly
+		if isinstance(document, DocumentView):
+			clip_idcs = [document.clip_idcs[clip_idx] for clip_idx in clip_idcs]
+			document = document.document
+		self.document = document
+		self.clip_idcs = clip_idcs
+		# internal housekeeping (built on first access)
+		self._type_idx_map = None
+
+	def __repr__(self):
+		return '<Document: "%s"%s, %d clippings>' % (
+				self.title,
+				' by "%s"' % self.author if self.author else '',
+				len(self.clip_idcs)
+			)
+
+	@property
+	def title(self):
+		return self.document.title
+
+	@property
+	def author(self):
+		return self.document.author
+
+	@property
+	def clippings(self):
+		return list(self.get_clippings())
+
+	def get_clippings(self, clip_type=None):
+		# return all indices is no type is specified
+		if clip_type is None:
+			clip_idcs = self.clip_idcs
+		# if type is specified, return only the relevant indices
+		else:
+			clip_idcs = self._get_type_idx_map().get(clip_type, [])
+		# yield clipping at index in each iteration
+		for clip_idx in clip_idcs:
+			yield self.document.clippings[clip_idx]
+
+	def get_clipping_types(self):
+		return list(self._get_type_idx_map().keys())
+
+	def add_clipping(self, clipping):
+		self._raise_read_only('add_clipping')
+
+	def del_clippings(self):
+		self._raise_read_only('del_clippings')
+
+	def merge_clippings(self):
+		self._raise_read_only('merge_clippings')
+
+	def remove_duplicate_clippings(self):
+		self._raise_read_only('remove_duplicate_clippings')
+
+	def deduplicate_clippings(self):
+		self._raise_read_only('deduplicate_clippings')
+
+	def to_document(self):
+		# create an independent document containing the same clipping objects
+		document = Document(self.title, self.author)
+		for clipping in self.get_clippings():
+			document.add_clipping(clipping)
+		return document
+
+	def _raise_read_only(self, name):
+		raise TypeError(f"[Error] {self} is a read-only view and does not support {name}() (use to_document() first).")
+
+	def _get_type_idx_map(self):
+		if self._type_idx_map is None:
+			self._type_idx_map = defaultdict(list)
+			for clip_idx in self.clip_idcs:
+				self._type_idx_map[self.document.clippings[clip_idx].clip_type].append(clip_idx)
+		return self._type_idx_map
+
+
 class Clipping:
+	__slots__ = ('_clip_type', '_clip_types', '_page', '_location', '_span', 'datetime', 'content')
+
 	def __init__(self, page, location, datetime, content, clip_type):
 		self.clip_type = clip_type # 'TYPE' or 'TYPE+TYPE'
 		self.page = page # (START, END) or None
@@ -106,20 +361,69 @@ class Clipping:
 	def __lt__(self, other):
 		assert isinstance(other, Clipping), "Cannot compare %s and %s." % (self, other)
 		# compare normalized starting positions
-		return self.get_position(prefer_location=True, as_type=int)[0] < other.get_position(prefer_location=True, as_type=int)[0]
+		return self.sort_key() < other.sort_key()
+
+	#
+	# cached properties (reset whenever the underlying fields change)
+	#
+
+	@property
+	def clip_type(self):
+		return self._clip_type
+
+	@clip_type.setter
+	def clip_type(self, clip_type):
+		self._clip_type = clip_type
+		self._clip_types = None
+
+	@property
+	def clip_types(self):
+		# set of types contained in merged type 'TYPE+TYPE'
+		if self._clip_types is None:
+			self._clip_types = frozenset(self._clip_type.split('+'))
+		return self._clip_types
+
+	@property
+	def page(self):
+		return self._page
+
+	@page.setter
+	def page(self, page):
+		self._page = page
+		self._span = None
+
+	@property
+	def location(self):
+		return self._location
+
+	@location.setter
+	def location(self, location):
+		self._location = location
+		self._span = None
+
+	@property
+	def span(self):
+		# normalized position, equivalent to get_position(prefer_location=True, as_type=int)
+		if self._span is None:
+			self._span = self.get_position(prefer_location=True, as_type=int)
+		return self._span
+
+	def sort_key(self):
+		# normalized starting position, use as key when sorting clippings
+		return self.span[0]
 
 	def subsumes(self, other):
 		assert isinstance(other, Clipping), "%s cannot subsume %s." % (self, other)
-		subsumes = False
 
-		# check whether the range of this clipping subsumes the other
-		position = self.get_position(prefer_location=True, as_type=int)
-		other_position = other.get_position(prefer_location=True, as_type=int)
-		subsumes = (position[0] <= other_position[0]) and (position[1] >= other_position[1])
+		# check whether the range of this clipping subsumes the other (required in all cases)
+		position, other_position = self.span, other.span
+		if (position[0] > other_position[0]) or (position[1] < other_position[1]):
+			return False
+		subsumes = True
 
 		# check if this clipping subsumes the type of the other
-		clip_types = set(self.clip_type.split('+'))
-		other_clip_types = set(other.clip_type.split('+'))
+		clip_types = self.clip_types
+		other_clip_types = other.clip_types
 		if len(clip_types & other_clip_types) > 0:
 			subsumes_content = True
 			# if this clipping is merged, compare each content
@@ -143,10 +447,11 @@ class Clipping:
 
 	def merge(self, other):
 		assert isinstance(other, Clipping), "Cannot merge %s and %s." % (self, other)
-		merged = copy.deepcopy(self)
+		# shallow copy, as all merged fields are replaced below
+		merged = Clipping(self.page, self.location, self.datetime, self.content, self.clip_type)
 
 		# merge clip types
-		merged.clip_type = '+'.join(sorted(set(self.clip_type.split('+') + other.clip_type.split('+'))))
+		merged.clip_type = '+'.join(sorted(self.clip_types | other.clip_types))
 
 		# merge pages
 		if self.page and other.page:
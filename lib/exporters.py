@@ -1,6 +1,58 @@
-import datetime, re
-
-from collections import OrderedDict
+import datetime, os, re
+
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from lib.data import *
+from lib.matching import *
+
+# removed from PDF text: hyphens and line breaks following them
+PDF_TEXT_CLEANUP_PATTERN = re.compile(r'-\n?')
+# maximum number of pages with extracted text kept in memory by the PdfMergeExporter
+PAGE_CACHE_SIZE = 16
+# normalized schema of the SqliteExporter (datetimes are stored as 'YYYY-MM-DD HH:MM:SS')
+SQLITE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS documents (
+	id INTEGER PRIMARY KEY,
+	title TEXT NOT NULL,
+	author TEXT
+);
+CREATE TABLE IF NOT EXISTS clippings (
+	id INTEGER PRIMARY KEY,
+	fingerprint BLOB NOT NULL UNIQUE,
+	document_id INTEGER NOT NULL REFERENCES documents(id),
+	type TEXT NOT NULL,
+	page_start INTEGER,
+	page_end INTEGER,
+	location_start INTEGER,
+	location_end INTEGER,
+	datetime TEXT,
+	content TEXT,
+	merged INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS clipping_members (
+	clipping_id INTEGER NOT NULL REFERENCES clippings(id),
+	position INTEGER NOT NULL,
+	fingerprint BLOB NOT NULL,
+	type TEXT NOT NULL,
+	page_start INTEGER,
+	page_end INTEGER,
+	location_start INTEGER,
+	location_end INTEGER,
+	datetime TEXT,
+	content TEXT,
+	PRIMARY KEY (clipping_id, position)
+);
+CREATE INDEX IF NOT EXISTS documents_title ON documents(title);
+CREATE INDEX IF NOT EXISTS documents_author ON documents(author);
+CREATE INDEX IF NOT EXISTS clippings_document ON clippings(document_id);
+CREATE INDEX IF NOT EXISTS clippings_type ON clippings(type);
+CREATE INDEX IF NOT EXISTS clippings_location ON clippings(location_start, location_end);
+CREATE INDEX IF NOT EXISTS clippings_datetime ON clippings(datetime);
+CREATE INDEX IF NOT EXISTS clipping_members_fingerprint ON clipping_members(fingerprint);
+'''
+# number of rows inserted per executemany() call
+SQLITE_BATCH_SIZE = 10000
 
 def parse_exporter(exporter_str):
 	exporter = None
@@ -22,32 +74,70 @@ def parse_exporter(exporter_str):
 
 
 class Exporter:
+	# whether writing to an existing path replaces its contents
+	overwrites = True
+	# extension of files written per document
+	extension = '.txt'
+	# whether the output can be written to file objects (e.g. STDOUT)
+	dumps = True
+	# whether the output ends in a line break (e.g. one record per line)
+	line_terminated = False
+	# whether to print additional information (e.g. summaries of batch exports)
+	verbose = False
+
+	def iter_export(self, documents):
+		# exporters which can produce their output in chunks override this method
+		yield self(documents)
+
+	def dump(self, documents, file):
+		# write chunks of the output to a file object
+		for chunk in self.iter_export(documents):
+			file.write(chunk)
+
+	def dump_clippings(self, clippings, file, doc_keys=None):
+		# group streamed clippings by document as the output is ordered by document
+		self.dump(collect_documents(clippings, doc_keys=doc_keys), file)
+
 	def write(self, documents, path):
 		# convert file and write to specified path
 		with open(path, 'w', encoding='utf8') as file:
-			file.write(self(documents))
+			self.dump(documents, file)
+
+	def write_clippings(self, clippings, path, doc_keys=None):
+		with open(path, 'w', encoding='utf8') as file:
+			self.dump_clippings(clippings, file, doc_keys=doc_keys)
 
 
 class JsonExporter(Exporter):
+	extension = '.json'
+
 	def __init__(self, date_format='%Y-%m-%d %H:%M:%S'):
 		self.date_format = date_format
 
 	def __call__(self, documents):
-		import json
+		return ''.join(self.iter_export(documents))
 
-		res = []
+	def __repr__(self):
+		return '<JsonExporter: dateformat "%s">' % self.date_format
 
-		# iterate over documents
-		for title, author in documents:
-			res.append(self._document_to_json(documents[(title, author)]))
+	def iter_export(self, documents):
+		import json
 
 		# reduce to single object if results contain only one document
-		res = res[0] if len(res) == 1 else res
-
-		return json.dumps(res, indent=4)
-
-	def __repr__(self):
-		return '<JsonExporter: dateformat "%s">' % self.date_format
+		if len(documents) == 1:
+			yield json.dumps(self._document_to_json(documents[list(documents.keys())[0]]), indent=4)
+			return
+
+		# produce the same output as json.dumps(list, indent=4), one document at a time
+		if len(documents) == 0:
+			yield '[]'
+			return
+		yield '['
+		for doc_idx, (title, author) in enumerate(documents):
+			res = json.dumps(self._document_to_json(documents[(title, author)]), indent=4)
+			# indent document by one additional level (newlines within strings are escaped)
+			yield '%s\n    %s' % (',' if doc_idx > 0 else '', res.replace('\n', '\n    '))
+		yield '\n]'
 
 	def _document_to_json(self, document):
 		res = OrderedDict()
@@ -57,7 +147,7 @@ class JsonExporter(Exporter):
 		res['clippings'] = []
 
 		# iterate over clippings
-		for clipping in sorted(document.get_clippings()):
+		for clipping in sorted(document.get_clippings(), key=Clipping.sort_key):
 			res['clippings'].append(self._clipping_to_json(clipping))
 
 		return res
@@ -83,48 +173,77 @@ class JsonExporter(Exporter):
 		return res
 
 
+class JsonlExporter(JsonExporter):
+	'''Exports one JSON object per line and clipping, including the title and author of its document.
+
+	Clippings are grouped by document and sorted by position, also if they are streamed (see Exporter.dump_clippings).
+	'''
+	extension = '.jsonl'
+	line_terminated = True
+
+	def __repr__(self):
+		return '<JsonlExporter: dateformat "%s">' % self.date_format
+
+	def iter_export(self, documents):
+		# iterate over documents and their clippings sorted by position
+		for title, author in documents:
+			for clipping in sorted(documents[(title, author)].get_clippings(), key=Clipping.sort_key):
+				yield self._clipping_to_jsonl((title, author), clipping)
+
+	def _clipping_to_jsonl(self, doc_key, clipping):
+		import json
+
+		res = OrderedDict()
+		res['title'], res['author'] = doc_key
+		res.update(self._clipping_to_json(clipping))
+
+		return json.dumps(res) + '\n'
+
+
 class MarkdownExporter(Exporter):
+	extension = '.md'
+
 	def __init__(self, date_format='%Y-%m-%d %H:%M:%S'):
 		self.date_format = date_format
 
 	def __call__(self, documents):
-		res = ''
+		return ''.join(self.iter_export(documents))
+
+	def __repr__(self):
+		return '<MarkdownExporter: dateformat "%s">' % self.date_format
+
+	def iter_export(self, documents):
 		# determine heading level
 		heading_level = ''
 		if len(documents) > 1:
 			heading_level = '#'
-			res = f'# Clippings for {len(documents)} Documents\n\n'
+			yield f'# Clippings for {len(documents)} Documents\n\n'
 
 		# iterate over titles
 		for title, author in sorted(documents):
-			res += self._document_to_markdown(documents[(title, author)], heading_level)
-
-		return res
-
-	def __repr__(self):
-		return '<MarkdownExporter: dateformat "%s">' % self.date_format
+			yield from self._iter_document_markdown(documents[(title, author)], heading_level)
 
-	def _document_to_markdown(self, document, heading_level=''):
+	def _iter_document_markdown(self, document, heading_level=''):
 		# create title '# TITLE'
-		res = '%s# %s\n\n' % (heading_level, document.title)
+		yield '%s# %s\n\n' % (heading_level, document.title)
 
 		# add author if available
-		res += '%s\n\n' % document.author if document.author else ''
+		if document.author:
+			yield '%s\n\n' % document.author
 
-		for clip_type in sorted(document.get_clipping_types(), ):
+		for clip_type in sorted(document.get_clipping_types()):
 			# add type title
-			res += '%s## %s\n\n' % (heading_level, ' + '.join([ct.title() + 's' for ct in clip_type.split('+')]))
+			yield '%s## %s\n\n' % (heading_level, ' + '.join([ct.title() + 's' for ct in clip_type.split('+')]))
 			# iterate over clippings sorted by position
-			for clipping in sorted(document.get_clippings(clip_type)):
-				res += self._clipping_to_markdown(clipping, heading_level)
-		return res
+			for clipping in sorted(document.get_clippings(clip_type), key=Clipping.sort_key):
+				yield self._clipping_to_markdown(clipping, heading_level)
 
 	def _clipping_to_markdown(self, clipping, heading_level=''):
-		res = ''
+		res = []
 
 		position = clipping.get_position()
-		res += '%s### %s\n\n' % (heading_level, position)
-		
+		res.append('%s### %s\n\n' % (heading_level, position))
+
 		# add content
 		if clipping.content:
 			# process merged content
@@ -133,23 +252,114 @@ class MarkdownExporter(Exporter):
 				for mi, mc in enumerate(sorted(clipping.content, key=lambda el: el.datetime)):
 					# TODO merge identical or overlapping content
 					# produce quote blocks for each content '> [TYPE] CONTENT'
-					res += '>[%s] %s\n\n' % (mc.clip_type.title(), mc.content)
+					res.append('>[%s] %s\n\n' % (mc.clip_type.title(), mc.content))
 					# add datetime
 					if len(self.date_format) > 0:
 						# check if difference to next content is > 30 seconds
 						if (mi == len(clipping.content) - 1) or ((clipping.content[mi+1].datetime - mc.datetime) > datetime.timedelta(seconds=30)):
-							res += 'Added around %s.\n\n' % clipping.datetime.strftime(self.date_format)
+							res.append('Added around %s.\n\n' % clipping.datetime.strftime(self.date_format))
 			# standard procedure
 			else:
-				res += '> %s\n\n' % clipping.content
+				res.append('> %s\n\n' % clipping.content)
 				# add datetime
 				if len(self.date_format) > 0:
-					res += 'Added on %s.\n\n' % clipping.datetime.strftime(self.date_format)
-		return res
+					res.append('Added on %s.\n\n' % clipping.datetime.strftime(self.date_format))
+		return ''.join(res)
+
+
+class SqliteExporter(Exporter):
+	'''Stores documents and clippings in a SQLite database.
+
+	Clippings are identified by their fingerprints, so that exporting a grown clippings file into an
+	existing database only inserts the new clippings. Merged clippings store their contents as members
+	and replace stored clippings which they contain (e.g. a highlight to which a note was added later).
+	All rows are inserted in a single transaction.
+	'''
+	overwrites = False
+	dumps = False
+	extension = '.db'
+
+	def __repr__(self):
+		return '<SqliteExporter>'
+
+	def write(self, documents, path):
+		self.write_clippings(
+			((doc_key, clipping) for doc_key in documents for clipping in documents[doc_key].get_clippings()),
+			path
+		)
+
+	def write_clippings(self, clippings, path, doc_keys=None):
+		import sqlite3
+
+		connection = sqlite3.connect(path)
+		try:
+			connection.executescript(SQLITE_SCHEMA)
+			# fingerprints of the clippings and members in this export (dropped when the connection is closed)
+			connection.execute('CREATE TEMP TABLE exported (fingerprint BLOB PRIMARY KEY)')
+			connection.execute('CREATE TEMP TABLE exported_members (fingerprint BLOB PRIMARY KEY)')
+			# commit all insertions at once
+			with connection:
+				document_ids = {(title, author): doc_id for doc_id, title, author in connection.execute('SELECT id, title, author FROM documents')}
+				clipping_rows, member_rows = [], []
+				for doc_key, clipping in clippings:
+					# add document if new
+					if doc_key not in document_ids:
+						document_ids[doc_key] = connection.execute('INSERT INTO documents (title, author) VALUES (?, ?)', doc_key).lastrowid
+					fingerprint = get_clipping_fingerprint(doc_key, clipping)
+					clipping_rows.append((fingerprint, document_ids[doc_key]) + self._clipping_to_row(clipping) + (int(clipping.is_merged()), ))
+					if clipping.is_merged():
+						member_rows += [
+							(fingerprint, position, get_clipping_fingerprint(doc_key, member)) + self._clipping_to_row(member)
+							for position, member in enumerate(clipping.content)
+						]
+					# insert in batches, so that the stream of clippings doesn't need to be held in memory
+					if len(clipping_rows) >= SQLITE_BATCH_SIZE:
+						self._insert_rows(connection, clipping_rows, member_rows)
+						clipping_rows, member_rows = [], []
+				self._insert_rows(connection, clipping_rows, member_rows)
+				# replace stored clippings which were merged in the meantime
+				self._remove_superseded(connection)
+		finally:
+			connection.close()
+
+	def _insert_rows(self, connection, clipping_rows, member_rows):
+		# skip clippings which are already stored (upsert by fingerprint)
+		connection.executemany(
+			'''INSERT INTO clippings (fingerprint, document_id, type, page_start, page_end, location_start, location_end, datetime, content, merged)
+			VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (fingerprint) DO NOTHING''',
+			clipping_rows
+		)
+		# members reference their merged clipping by its fingerprint
+		connection.executemany(
+			'''INSERT INTO clipping_members (clipping_id, position, fingerprint, type, page_start, page_end, location_start, location_end, datetime, content)
+			VALUES ((SELECT id FROM clippings WHERE fingerprint = ?), ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (clipping_id, position) DO NOTHING''',
+			member_rows
+		)
+		# remember the exported clippings and members (see _remove_superseded)
+		connection.executemany('INSERT OR IGNORE INTO exported VALUES (?)', [(clipping_row[0], ) for clipping_row in clipping_rows])
+		connection.executemany('INSERT OR IGNORE INTO exported_members VALUES (?)', [(member_row[2], ) for member_row in member_rows])
+
+	def _remove_superseded(self, connection):
+		# stored clippings which were not exported, but are (or contain) members of exported merged clippings
+		connection.execute('''CREATE TEMP TABLE superseded AS SELECT id FROM clippings WHERE (fingerprint NOT IN (SELECT fingerprint FROM exported)) AND (
+			((merged = 0) AND (fingerprint IN (SELECT fingerprint FROM exported_members)))
+			OR ((merged = 1) AND (id IN (SELECT clipping_id FROM clipping_members WHERE fingerprint IN (SELECT fingerprint FROM exported_members))))
+		)''')
+		connection.execute('DELETE FROM clipping_members WHERE clipping_id IN (SELECT id FROM superseded)')
+		connection.execute('DELETE FROM clippings WHERE id IN (SELECT id FROM superseded)')
+
+	def _clipping_to_row(self, clipping):
+		page = clipping.page or (None, None)
+		location = clipping.location or (None, None)
+		date_time = clipping.datetime.strftime('%Y-%m-%d %H:%M:%S') if clipping.datetime else None
+		content = None if clipping.is_merged() else clipping.content
+		return (clipping.clip_type, page[0], page[1], location[0], location[1], date_time, content)
 
 
 class PdfMergeExporter(Exporter):
-	def __init__(self, doc_path):
+	extension = '.pdf'
+
+	def __init__(self, doc_path, jobs='1'):
 		# test whether mupdf is installed
 		self.fitz = None
 		try:
@@ -158,10 +368,17 @@ class PdfMergeExporter(Exporter):
 		except ImportError as err:
 			print("[Error] 'PyMuPDF' is required for the PdfMergeExporter.")
 			raise err
-		# parse document paths
+		# parse document paths (a directory or manifest maps multiple titles to PDFs)
 		self.doc_path = doc_path
+		self.doc_paths = self._load_doc_paths(doc_path)
+		# multiple PDFs are merged into an output directory, so they can't be written to file objects
+		self.dumps = self.doc_paths is None
+		self.jobs = int(jobs)
+		# cache of extracted page data {page number: (page_txt, page_txt_raw, raw_idx_map, automaton)}
+		self._page_cache = OrderedDict()
 
 	def __call__(self, documents):
+		assert self.doc_paths is None, f"[Error] PdfMergeExporter requires an output directory to merge multiple PDFs from '{self.doc_path}'."
 		assert len(documents) == 1, f"[Error] PdfMergeExporter can only process one document at a time (received {len(documents)})."
 
 		pdf_bytes = self._merge_document(documents[list(documents.keys())[0]], self.doc_path)
@@ -171,139 +388,248 @@ class PdfMergeExporter(Exporter):
 	def __repr__(self):
 		return f'<PdfMergeExporter:  "{self.doc_path}">'
 
-	def _get_page_text(self, page):
-		page_txt = ''
+	def _load_doc_paths(self, doc_path):
+		'''Loads the mapping of document titles to PDFs from a directory or a JSON manifest.
+
+		PDFs in a directory are matched by their filename without extension. Relative paths in a
+		manifest are resolved relative to the manifest's directory.
+
+		Returns:
+			dict: {'title': 'path/to/document.pdf', ...} or None if doc_path is a single PDF
+		'''
+		if os.path.isdir(doc_path):
+			return {
+				os.path.splitext(filename)[0]: os.path.join(doc_path, filename)
+				for filename in sorted(os.listdir(doc_path)) if filename.lower().endswith('.pdf')
+			}
+		if doc_path.lower().endswith('.json'):
+			import json
+			with open(doc_path, 'r', encoding='utf8') as file:
+				manifest = json.load(file)
+			assert isinstance(manifest, dict), f"[Error] PDF manifest '{doc_path}' must map document titles to PDF paths."
+			return {title: os.path.join(os.path.dirname(doc_path), path) for title, path in manifest.items()}
+		return None
+
+	def _get_page_data(self, page):
+		# reuse text and automaton of recently searched pages (LRU)
+		if page.number in self._page_cache:
+			self._page_cache.move_to_end(page.number)
+			return self._page_cache[page.number]
+
 		page_txt_raw = page.getText()
+		# remove all '-' (including line breaks following them) and map remaining characters to their raw indices
 		raw_idx_map = []
-
 		cursor_idx = 0
-		while cursor_idx < len(page_txt_raw):
-			# retrieve current character
-			cur_char = page_txt_raw[cursor_idx]
-			# check for '-\n' sequence
-			if cur_char == '-':
-				if (cursor_idx + 1 < len(page_txt_raw)) and (page_txt_raw[cursor_idx + 1] == '\n'):
-					# skip additional character
-					cursor_idx += 1
-			# check for '\n'
-			elif cur_char == '\n':
-				page_txt += ' '
-				raw_idx_map.append(cursor_idx)
-			# append all other characters as is
-			else:
-				page_txt += cur_char
-				raw_idx_map.append(cursor_idx)
-
-			cursor_idx += 1
-
-		return page_txt, page_txt_raw, raw_idx_map
+		for match in PDF_TEXT_CLEANUP_PATTERN.finditer(page_txt_raw):
+			raw_idx_map.extend(range(cursor_idx, match.start()))
+			cursor_idx = match.end()
+		raw_idx_map.extend(range(cursor_idx, len(page_txt_raw)))
+		# replace remaining line breaks with spaces
+		page_txt = PDF_TEXT_CLEANUP_PATTERN.sub('', page_txt_raw).replace('\n', ' ')
+
+		page_data = (page_txt, page_txt_raw, raw_idx_map, SuffixAutomaton(page_txt))
+		self._page_cache[page.number] = page_data
+		if len(self._page_cache) > PAGE_CACHE_SIZE:
+			self._page_cache.popitem(last=False)
+		return page_data
 
 	def _search_page(self, page, clipping, min_query_len=0):
-		results = []
-
-		# first, find the longest textual equivalent from the raw PDF text
+		# first, find the longest unambiguous textual equivalent from the raw PDF text
 		# extract and clean text from pdf
-		page_txt, page_txt_raw, raw_idx_map = self._get_page_text(page)
-		# start with full clipping content as query and remove '-'
+		page_txt, page_txt_raw, raw_idx_map, page_automaton = self._get_page_data(page)
+		# use full clipping content as query and remove '-'
 		clipping_txt = clipping.content.replace('-', '')
-		page_query = clipping_txt
-
-		query_len = len(clipping_txt)
-		while query_len > min_query_len:
-			ambiguous_match = False
-			start_idx = 0
-			while (start_idx + query_len) <= len(clipping_txt):
-				cur_query = clipping_txt[start_idx:start_idx+query_len]
-				pattern = re.compile(re.escape(cur_query))
-
-				matches = [m for m in pattern.finditer(page_txt)]
-				# if there is a single unambiguous match, use it
-				if len(matches) == 1:
-					# TODO improve capturing cleaner starts and ends of text spans when cleaned and raw text have different lengths
-					txt_start_idx = matches[0].start() - start_idx
-					txt_end_idx = txt_start_idx + len(clipping_txt)
-					page_query = page_txt_raw[raw_idx_map[txt_start_idx]:raw_idx_map[txt_end_idx]]
-					break
-				# if there are multiple matches, print warning and exit
-				elif len(matches) > 0:
-					ambiguous_match = True
-				start_idx += 1
-
-			# if a single unambiguous match was found, use it
-			if len(matches) == 1:
-				break
-
-			# if no unambiguous match was found with the current query_len, there's no point making it even less specific, so exit
-			if ambiguous_match:
-				return []
-
-			query_len -= 1
-
-		# if there are no matches, print warning and exit
-		if len(matches) == 0:
+		match = page_automaton.find_longest_unique(clipping_txt, min_len=min_query_len)
+		# if there are no or only ambiguous matches, exit
+		if match is None:
 			return []
 
+		# TODO improve capturing cleaner starts and ends of text spans when cleaned and raw text have different lengths
+		query_start_idx, match_start_idx, _ = match
+		txt_start_idx = max(0, match_start_idx - query_start_idx)
+		txt_end_idx = txt_start_idx + len(clipping_txt)
+		raw_end_idx = raw_idx_map[txt_end_idx] if txt_end_idx < len(raw_idx_map) else len(page_txt_raw)
+		page_query = page_txt_raw[raw_idx_map[txt_start_idx]:raw_end_idx]
+
 		# next, search the actual PDF using the best textual match
-		query_len = len(page_query)
-		while query_len > min_query_len:
-			start_idx = 0
-			while (start_idx + query_len) <= len(page_query):
-				cur_query = page_query[start_idx:start_idx+query_len]
-				results = page.searchFor(cur_query)
-				# expects resulting Rects to be of the single correct textual match
-				if len(results) > 0:
-					break
-				start_idx += 1
-			if len(results) > 0:
-				break
-			query_len -= 1
+		return self._search_pdf(page, page_query, min_query_len=min_query_len)
 
+	def _search_pdf(self, page, query, min_query_len=0):
+		# the full query usually matches, as it was extracted from the same page
+		if len(query) <= min_query_len:
+			return []
+		results = page.searchFor(query)
+		if len(results) > 0:
+			return results
+		# binary search for the longest matching substring (substrings of a match match as well)
+		min_len, max_len = min_query_len + 1, len(query) - 1
+		while min_len <= max_len:
+			query_len = (min_len + max_len) // 2
+			cur_results = self._search_substrings(page, query, query_len)
+			if len(cur_results) > 0:
+				results = cur_results
+				min_len = query_len + 1
+			else:
+				max_len = query_len - 1
 		return results
 
-	def _merge_document(self, document, doc_path):
-		pdf_doc = self.fitz.open(doc_path)
+	def _search_substrings(self, page, query, query_len):
+		# expects resulting Rects to be of the single correct textual match
+		for start_idx in range(len(query) - query_len + 1):
+			results = page.searchFor(query[start_idx:start_idx+query_len])
+			if len(results) > 0:
+				return results
+		return []
 
-		for clipping in sorted(document.get_clippings()):
+	def _merge_document(self, document, doc_path, stats=None):
+		pdf_doc = self.fitz.open(doc_path)
+		stats = {} if stats is None else stats
+		stats['matched'], stats['unmatched'] = 0, 0
+		self._page_cache = OrderedDict()
+
+		# collect highlights of all clippings and group them by page
+		clipping_highlights = []
+		page_highlights = defaultdict(list)
+		for clipping in sorted(document.get_clippings(), key=Clipping.sort_key):
 			if 'highlight' in clipping.clip_type.split('+'):
 				contents = clipping.content if clipping.is_merged() else [clipping]
-				# process highlights
-				top_left = None
+				highlight_idcs = []
 				for highlight in [c for c in contents if c.clip_type == 'highlight']:
-					# retrieve rectangles from PDF to highlight
 					page_idx = highlight.get_position(as_type=int)[0] - 1
-					page = pdf_doc[page_idx]
-					results = self._search_page(page, highlight)
-					# skip clipping if it could not matched to the PDF
-					if len(results) < 1:
-						continue
-					# add highlight annotation using the resulting rectangles
-					page.addHighlightAnnot(results)
-					# get top right point of highlight annotation
-					for rect in results:
-						if (top_left is None) or ((rect.top_left.x < top_left.x) and (rect.top_left.y < top_left.y)):
-							top_left = rect.top_left
-				# if no highlight was matched, fall back to (0,0) origin
-				if top_left is None:
-					top_left = self.fitz.Point()
-
-				# process notes, if there are any
-				for note in [c for c in contents if c.clip_type == 'note']:
-					# shift top left by the size of the note icon
-					top_left.x = max(0, top_left.x - 20)
-					top_left.y = max(0, top_left.y - 20)
-					# add textual annotation at top right point of the highlight
-					page.addTextAnnot(top_left, note.content)
+					page_highlights[page_idx].append((len(clipping_highlights), len(highlight_idcs), highlight))
+					highlight_idcs.append(page_idx)
+				clipping_highlights.append((contents, highlight_idcs))
+
+		# retrieve rectangles from PDF to highlight {(clipping index, highlight index): [Rect, ...]}
+		matches = self._match_pages(pdf_doc, doc_path, sorted(page_highlights.items()))
+
+		# add all annotations in a single pass
+		for clip_idx, (contents, highlight_idcs) in enumerate(clipping_highlights):
+			# process highlights
+			top_left = None
+			for highlight_idx, page_idx in enumerate(highlight_idcs):
+				page = pdf_doc[page_idx]
+				results = matches[(clip_idx, highlight_idx)]
+				# skip clipping if it could not matched to the PDF
+				if len(results) < 1:
+					stats['unmatched'] += 1
+					continue
+				stats['matched'] += 1
+				# add highlight annotation using the resulting rectangles
+				page.addHighlightAnnot(results)
+				# get top right point of highlight annotation
+				for rect in results:
+					if (top_left is None) or ((rect.top_left.x < top_left.x) and (rect.top_left.y < top_left.y)):
+						top_left = rect.top_left
+			# if no highlight was matched, fall back to (0,0) origin
+			if top_left is None:
+				top_left = self.fitz.Point()
+
+			# process notes, if there are any
+			for note in [c for c in contents if c.clip_type == 'note']:
+				# shift top left by the size of the note icon
+				top_left.x = max(0, top_left.x - 20)
+				top_left.y = max(0, top_left.y - 20)
+				# add textual annotation at top right point of the highlight
+				page.addTextAnnot(top_left, note.content)
 
 		return pdf_doc.write()
 
+	def _match_pages(self, pdf_doc, doc_path, page_highlights):
+		# match highlights sequentially if there is nothing to parallelize
+		if (self.jobs < 2) or (len(page_highlights) < 2):
+			return self._match_highlights(pdf_doc, page_highlights)
+
+		# split pages into contiguous chunks, which are matched by workers opening the PDF independently
+		num_chunks = min(len(page_highlights), 4 * self.jobs)
+		chunk_size = -(-len(page_highlights) // num_chunks)
+		chunks = [page_highlights[chunk_idx:chunk_idx+chunk_size] for chunk_idx in range(0, len(page_highlights), chunk_size)]
+		matches = {}
+		with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+			for chunk_matches in executor.map(_match_pdf_pages, [doc_path] * len(chunks), chunks):
+				# convert plain rectangle coordinates back to Rects
+				for match_key, rects in chunk_matches.items():
+					matches[match_key] = [self.fitz.Rect(rect) for rect in rects]
+		return matches
+
+	def _match_highlights(self, pdf_doc, page_highlights):
+		matches = {}
+		for page_idx, highlights in page_highlights:
+			page = pdf_doc[page_idx]
+			for clip_idx, highlight_idx, highlight in highlights:
+				matches[(clip_idx, highlight_idx)] = self._search_page(page, highlight)
+		return matches
+
+	def _merge_documents(self, documents, output_dir):
+		os.makedirs(output_dir, exist_ok=True)
+		# match documents to PDFs
+		tasks, unmatched_documents = [], []
+		for title, author in sorted(documents):
+			document = documents[(title, author)]
+			if title not in self.doc_paths:
+				unmatched_documents.append(document)
+				continue
+			doc_path = self.doc_paths[title]
+			output_path = os.path.join(output_dir, os.path.basename(doc_path))
+			assert os.path.abspath(output_path) != os.path.abspath(doc_path), f"[Error] PdfMergeExporter cannot overwrite the original PDF '{doc_path}'."
+			tasks.append((detach_document(document), doc_path, output_path))
+
+		# annotate each PDF in a separate process
+		if (self.jobs > 1) and (len(tasks) > 1):
+			with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+				results = list(executor.map(_merge_pdf, *zip(*tasks)))
+		else:
+			results = [_merge_pdf(*task) for task in tasks]
+
+		# print summary
+		if not self.verbose:
+			return
+		print("PDFs (%d merged):" % len(tasks))
+		for (document, doc_path, output_path), stats in zip(tasks, results):
+			print(f"  {document} -> '{output_path}' ({stats['matched']} matched, {stats['unmatched']} unmatched highlights)")
+		if unmatched_documents:
+			print("  No PDF found for %d documents:" % len(unmatched_documents))
+			for document in unmatched_documents:
+				print(f"    {document}")
+
+	def dump(self, documents, file):
+		# write binary output to the underlying buffer of text files (e.g. STDOUT)
+		getattr(file, 'buffer', file).write(self(documents))
+
 	def write(self, documents, path):
+		# merge multiple PDFs into the output directory
+		if self.doc_paths is not None:
+			self._merge_documents(documents, path)
+			return
 		# convert file and write to specified path
 		with open(path, 'wb') as file:
-			file.write(self(documents))
+			self.dump(documents, file)
+
+	def write_clippings(self, clippings, path, doc_keys=None):
+		self.write(collect_documents(clippings, doc_keys=doc_keys), path)
+
+
+def _merge_pdf(document, doc_path, output_path):
+	# merge a single PDF in a worker process and return the number of (un)matched highlights
+	exporter = PdfMergeExporter(doc_path)
+	stats = {}
+	pdf_bytes = exporter._merge_document(document, doc_path, stats=stats)
+	with open(output_path, 'wb') as file:
+		file.write(pdf_bytes)
+	return stats
+
+def _match_pdf_pages(doc_path, page_highlights):
+	# match highlights on a chunk of pages in a worker process and return plain rectangle coordinates
+	exporter = PdfMergeExporter(doc_path)
+	pdf_doc = exporter.fitz.open(doc_path)
+	matches = exporter._match_highlights(pdf_doc, page_highlights)
+	return {match_key: [tuple(rect) for rect in rects] for match_key, rects in matches.items()}
 
 
 EXPORTER_MAP = {
 	'json': JsonExporter,
+	'jsonl': JsonlExporter,
 	'markdown': MarkdownExporter,
-	'pdfmerge': PdfMergeExporter
+	'pdfmerge': PdfMergeExporter,
+	'sqlite': SqliteExporter
 }
\ No newline at end of file
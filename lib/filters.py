@@ -1,69 +1,310 @@
-import copy, datetime, re
+import datetime, operator, re
 
 from collections import defaultdict
 
 from lib.data import *
+from lib.index import *
 
 def parse_filters(filter_strs):
 	filters = []
 
 	for filter_str in filter_strs:
-		filter_match = re.match(r'^([a-zA-Z0-9_\-]+)(\((.*)\))?$', filter_str)
-		# check if filter syntax is correct
-		if filter_match is None:
-			print(f"[Warning] Unknown filter syntax '{filter_str}'. Skipped.")
-			continue
-		# filter name should always be present
-		filter_type = filter_match[1]
-		filter_args = tuple()
-		# parse arguments if any
-		if filter_match[3]:
-			for filter_arg_str in re.split(r",\s*(?=')", filter_match[3]):
-				filter_args += (filter_arg_str[1:-1], ) # remove surrounding quotes and add
-		# check if filter exists
-		if filter_type not in FILTER_MAP:
-			print(f"[Warning] Unknown filter '{filter_type}'. Skipped.")
-			continue
-		# try to construct filter
+		# parse filter or filter expression, e.g. "title('A') and not (type('note') or after('2020-01-01 00:00:00'))"
 		try:
-			filters.append(FILTER_MAP[filter_type](*filter_args))
-		# catch error for missing arguments
-		except TypeError as err:
-			print(f"[Warning] Filter '{filter_type}' could not be constructed ({err}). Skipped.")
+			filters.append(parse_filter_expression(filter_str))
+		# catch errors for unknown syntax and filters
+		except ValueError as err:
+			print(f"[Warning] {err} Skipped.")
 			continue
 
 	return filters
 
+def parse_filter_expression(filter_str):
+	'''Parses a boolean expression of filters combined using 'and', 'or', 'not' and parentheses.
+
+	Raises:
+		ValueError: if the syntax is unknown or a filter can't be constructed
+	'''
+	expression, position = _parse_or(filter_str, 0)
+	position = _skip_whitespace(filter_str, position)
+	if position < len(filter_str):
+		raise _syntax_error(filter_str, position, "'and', 'or' or the end of the expression")
+	return expression
+
+def _syntax_error(filter_str, position, expected):
+	# e.g. "Unknown filter syntax 'type ('note')' at column 5 (expected '(')."
+	return ValueError(f"Unknown filter syntax '{filter_str}' at column {position + 1} (expected {expected}).")
+
+def _skip_whitespace(filter_str, position):
+	while (position < len(filter_str)) and filter_str[position].isspace():
+		position += 1
+	return position
+
+def _match_keyword(filter_str, position, keyword):
+	# returns position after keyword if it is present as a separate word
+	match = FILTER_KEYWORD_PATTERN.match(filter_str, _skip_whitespace(filter_str, position))
+	if match and (match[1].lower() == keyword):
+		return match.end()
+	return None
+
+def _parse_or(filter_str, position):
+	operands = []
+	while True:
+		operand, position = _parse_and(filter_str, position)
+		operands.append(operand)
+		next_position = _match_keyword(filter_str, position, 'or')
+		if next_position is None:
+			break
+		position = next_position
+	return (operands[0] if len(operands) == 1 else OrFilter(*operands)), position
+
+def _parse_and(filter_str, position):
+	operands = []
+	while True:
+		operand, position = _parse_not(filter_str, position)
+		operands.append(operand)
+		next_position = _match_keyword(filter_str, position, 'and')
+		if next_position is None:
+			break
+		position = next_position
+	return (operands[0] if len(operands) == 1 else AndFilter(*operands)), position
+
+def _parse_not(filter_str, position):
+	next_position = _match_keyword(filter_str, position, 'not')
+	if next_position is not None:
+		operand, position = _parse_not(filter_str, next_position)
+		return NotFilter(operand), position
+	return _parse_atom(filter_str, position)
+
+def _parse_atom(filter_str, position):
+	position = _skip_whitespace(filter_str, position)
+	# parse parenthesized expression
+	if filter_str.startswith('(', position):
+		expression, position = _parse_or(filter_str, position + 1)
+		position = _skip_whitespace(filter_str, position)
+		if not filter_str.startswith(')', position):
+			raise _syntax_error(filter_str, position, "')'")
+		return expression, position + 1
+
+	# parse filter "filter('arg', 'arg')"
+	name_match = FILTER_NAME_PATTERN.match(filter_str, position)
+	# check if filter syntax is correct
+	if name_match is None:
+		raise _syntax_error(filter_str, position, "a filter or '('")
+	# filter name should always be present
+	filter_type = name_match[0]
+	filter_args = tuple()
+	position = name_match.end()
+	# arguments directly follow the filter name (filters without arguments may omit the parentheses)
+	if filter_str.startswith('(', _skip_whitespace(filter_str, position)) and not filter_str.startswith('(', position):
+		raise _syntax_error(filter_str, position, "'(' directly after the filter name")
+	# parse arguments if any
+	if filter_str.startswith('(', position):
+		position = _skip_whitespace(filter_str, position + 1)
+		while not filter_str.startswith(')', position):
+			# arguments are quoted and end at a quote followed by ',' or ')'
+			arg_end = FILTER_ARG_END_PATTERN.search(filter_str, position + 1)
+			if (not filter_str.startswith("'", position)) or (arg_end is None):
+				raise _syntax_error(filter_str, position, "a quoted argument or ')'")
+			filter_args += (filter_str[position + 1:arg_end.start()], ) # remove surrounding quotes and add
+			position = _skip_whitespace(filter_str, arg_end.end())
+			if filter_str.startswith(',', position):
+				position = _skip_whitespace(filter_str, position + 1)
+		position += 1
+	# check if filter exists
+	if filter_type not in FILTER_MAP:
+		raise ValueError(f"Unknown filter '{filter_type}'.")
+	# try to construct filter
+	try:
+		return FILTER_MAP[filter_type](*filter_args), position
+	# catch error for missing arguments
+	except TypeError as err:
+		raise ValueError(f"Filter '{filter_type}' could not be constructed ({err}).")
+
 def apply_filters(documents, filters):
+	'''Returns views on the documents and clippings which match all filters.
+
+	The filters are combined into a single expression. Its document-level parts are evaluated once per
+	original document, the remaining clipping-level parts are compiled into a single predicate which is
+	only evaluated for clippings of matching documents. No clippings are copied, the views reference the
+	original clippings by index.
+
+	Returns:
+		dict: {('title', 'author'): DocumentView, ...}
+	'''
+	expression = AndFilter(*filters)
 	filtered_documents = {}
 	# iterate over documents
-	for title, author in documents:
-		filtered_document = copy.deepcopy(documents[(title, author)])
+	for doc_key, document in documents.items():
 		# filter on document level
-		doc_filters = [doc_filt for doc_filt in filters if doc_filt.data_type == Document]
-		if doc_filters and not all([doc_filt(filtered_document) for doc_filt in doc_filters]):
+		predicate = expression.bind(document)
+		if predicate is False:
 			continue
-		# reset document clippings
-		filtered_document.del_clippings()
-		# iterate over clippings
-		for clipping in documents[(title, author)].get_clippings():
-			# filter on clipping level
-			clip_filters = [clip_filt for clip_filt in filters if clip_filt.data_type == Clipping]
-			if clip_filters and not all([clip_filt(clipping) for clip_filt in clip_filters]):
-				continue
-			filtered_document.add_clipping(clipping)
+		# filter on clipping level
+		if predicate is True:
+			clip_idcs = list(range(len(document.clippings)))
+		else:
+			predicate = predicate.compile()
+			clip_idcs = [clip_idx for clip_idx, clipping in enumerate(document.get_clippings()) if predicate(clipping)]
 		# if document has clippings, add to results
-		if len(filtered_document.clippings) > 0:
-			filtered_documents[(title, author)] = filtered_document
+		if len(clip_idcs) > 0:
+			filtered_documents[doc_key] = DocumentView(document, clip_idcs)
 	return filtered_documents
 
+def get_required_tokens(filters):
+	'''Collects the tokens which every clipping matching all filters contains (e.g. to select clippings using an index).
+
+	Only content filters which are not regular expressions and which are not part of an alternative or
+	negation are considered.
+
+	Returns:
+		set: {'token', ...}
+	'''
+	tokens = set()
+	for filt in filters:
+		if isinstance(filt, AndFilter):
+			tokens |= get_required_tokens(filt.operands)
+		elif isinstance(filt, ContentFilter) and (filt.mode != 'regex'):
+			tokens.update(filt.tokens)
+	return tokens
+
+def filter_clippings(clippings, filters, doc_keys=None):
+	'''Lazily applies filters to a stream of clippings.
+
+	Document-level parts of the filters are evaluated once per document on a clipping-less Document.
+	If a list of doc_keys is provided, the keys of all documents (including those without matching
+	clippings) are appended to it in the order of their first clipping.
+
+	Returns:
+		generator: (('title', 'author'), Clipping), ...
+	'''
+	expression = AndFilter(*filters)
+	# cache compiled clipping predicates per document key
+	predicates = {}
+	for doc_key, clipping in clippings:
+		if doc_key not in predicates:
+			if doc_keys is not None:
+				doc_keys.append(doc_key)
+			predicate = expression.bind(Document(*doc_key))
+			predicates[doc_key] = predicate if type(predicate) is bool else predicate.compile()
+		predicate = predicates[doc_key]
+		if (predicate is False) or ((predicate is not True) and not predicate(clipping)):
+			continue
+		yield doc_key, clipping
+
 class Filter:
+	# relative cost of evaluating the filter (used to order checks)
+	cost = 1
+
 	def __init__(self, data_type=None):
 		self.data_type = data_type
 
 	def __call__(self, data):
 		pass
 
+	def bind(self, document):
+		'''Evaluates document-level filters for a document.
+
+		Returns:
+			bool or Filter: result if the filter can be fully evaluated, else the remaining clipping-level filter
+		'''
+		if self.data_type == Document:
+			return bool(self(document))
+		return self
+
+	def compile(self):
+		# returns a function data -> bool
+		return self.__call__
+
+#
+# boolean filters
+#
+
+class BooleanFilter(Filter):
+	def __init__(self, *operands):
+		self.operands = operands
+		# data type is only set if all operands share it
+		data_types = {operand.data_type for operand in operands}
+		super(BooleanFilter, self).__init__(data_type=data_types.pop() if len(data_types) == 1 else None)
+		self.cost = sum(operand.cost for operand in operands)
+		self._compiled = None
+
+	def __repr__(self):
+		return '<%s: %s>' % (self.__class__.__name__, ', '.join(repr(operand) for operand in self.operands))
+
+	def compile(self):
+		if self._compiled is None:
+			self._compiled = self._compile()
+		return self._compiled
+
+class AndFilter(BooleanFilter):
+	def __call__(self, data):
+		return all(operand(data) for operand in self.operands)
+
+	def bind(self, document):
+		operands = []
+		for operand in self.operands:
+			operand = operand.bind(document)
+			if operand is False:
+				return False
+			if operand is not True:
+				operands.append(operand)
+		if len(operands) == 0:
+			return True
+		# keep this filter (and its compiled predicate) if no operand was reduced
+		if all(bound is operand for bound, operand in zip(operands, self.operands)) and (len(operands) == len(self.operands)):
+			return self
+		return operands[0] if len(operands) == 1 else AndFilter(*operands)
+
+	def _compile(self):
+		# evaluate cheap checks first, as evaluation stops at the first failing check
+		predicates = [operand.compile() for operand in sorted(self.operands, key=lambda o: o.cost)]
+		predicate = predicates[0] if predicates else (lambda data: True)
+		for next_predicate in predicates[1:]:
+			predicate = (lambda first, second: lambda data: first(data) and second(data))(predicate, next_predicate)
+		return predicate
+
+class OrFilter(BooleanFilter):
+	def __call__(self, data):
+		return any(operand(data) for operand in self.operands)
+
+	def bind(self, document):
+		operands = []
+		for operand in self.operands:
+			operand = operand.bind(document)
+			if operand is True:
+				return True
+			if operand is not False:
+				operands.append(operand)
+		if len(operands) == 0:
+			return False
+		# keep this filter (and its compiled predicate) if no operand was reduced
+		if all(bound is operand for bound, operand in zip(operands, self.operands)) and (len(operands) == len(self.operands)):
+			return self
+		return operands[0] if len(operands) == 1 else OrFilter(*operands)
+
+	def _compile(self):
+		# evaluate cheap checks first, as evaluation stops at the first successful check
+		predicates = [operand.compile() for operand in sorted(self.operands, key=lambda o: o.cost)]
+		predicate = predicates[0] if predicates else (lambda data: False)
+		for next_predicate in predicates[1:]:
+			predicate = (lambda first, second: lambda data: first(data) or second(data))(predicate, next_predicate)
+		return predicate
+
+class NotFilter(BooleanFilter):
+	def __call__(self, data):
+		return not self.operands[0](data)
+
+	def bind(self, document):
+		operand = self.operands[0].bind(document)
+		if type(operand) is bool:
+			return not operand
+		return self if operand is self.operands[0] else NotFilter(operand)
+
+	def _compile(self):
+		predicate = self.operands[0].compile()
+		return lambda data: not predicate(data)
+
 #
 # string filters
 #
@@ -79,6 +320,7 @@ class StringFilter(Filter):
 		if self.mode == 'regex':
 			pattern = re.compile(self.match)
 			self.matcher = pattern.search
+			self.cost = 10
 		else:
 			self.matcher = lambda s: s == self.match
 
@@ -87,6 +329,10 @@ class StringFilter(Filter):
 			return False
 		return self.matcher(self.field(data))
 
+	def compile(self):
+		field, matcher = self.field, self.matcher
+		return lambda data: bool(matcher(field(data)))
+
 	def __repr__(self):
 		return '<%s: %s"%s", %s mode>' % (
 			self.__class__.__name__,
@@ -107,6 +353,48 @@ class TypeFilter(StringFilter):
 	def __init__(self, match, mode='exact'):
 		super(TypeFilter, self).__init__(field=lambda c: c.clip_type, match='+'.join(sorted(match.lower().split('+'))), mode=mode, data_type=Clipping)
 
+#
+# content filters
+#
+
+class ContentFilter(Filter):
+	def __init__(self, match, mode='phrase'):
+		super(ContentFilter, self).__init__(data_type=Clipping)
+		self.match = match
+		mode = mode.lower()
+		assert mode in ['phrase', 'all', 'regex'], f"Unsupported filter mode '{mode}'."
+		self.mode = mode
+		if self.mode == 'regex':
+			self.matcher = re.compile(self.match).search
+			self.cost = 20
+		else:
+			self.tokens = tokenize(self.match)
+			if self.mode == 'phrase':
+				# match the token sequence with surrounding spaces to only match full tokens
+				phrase = ' %s ' % ' '.join(self.tokens)
+				self.matcher = lambda s: phrase in ' %s ' % ' '.join(tokenize(s))
+			else:
+				tokens = set(self.tokens)
+				self.matcher = lambda s: tokens.issubset(tokenize(s))
+			self.cost = 10
+
+	def __call__(self, data):
+		if self.data_type and not isinstance(data, self.data_type):
+			return False
+		return bool(self.matcher(get_clipping_text(data)))
+
+	def compile(self):
+		matcher = self.matcher
+		return lambda data: bool(matcher(get_clipping_text(data)))
+
+	def __repr__(self):
+		return '<%s: %s"%s", %s mode>' % (
+			self.__class__.__name__,
+			f'{self.data_type.__name__}, ' if self.data_type else '',
+			self.match,
+			self.mode
+		)
+
 #
 # comparison filters
 #
@@ -130,6 +418,11 @@ class ComparisonFilter(Filter):
 			return self.field(data) > self.reference
 		return False
 
+	def compile(self):
+		field, reference = self.field, self.reference
+		compare = {'=': operator.eq, '<': operator.lt, '>': operator.gt}[self.mode]
+		return lambda data: compare(field(data), reference)
+
 	def __repr__(self):
 		return '<%s: %s%s "%s">' % (
 			self.__class__.__name__,
@@ -149,11 +442,17 @@ class BeforeFilter(ComparisonFilter):
 		super(BeforeFilter, self).__init__(field=lambda c: c.datetime, reference=ref_datetime, mode='<', data_type=Clipping)
 
 
+FILTER_NAME_PATTERN = re.compile(r'[a-zA-Z0-9_\-]+')
+FILTER_KEYWORD_PATTERN = re.compile(r'(and|or|not)(?![a-zA-Z0-9_\-])', re.IGNORECASE)
+FILTER_ARG_END_PATTERN = re.compile(r"'(?=\s*[,)])")
+
 FILTER_MAP = {
 	# string filters
 	'title': TitleFilter,
 	'author': AuthorFilter,
 	'type': TypeFilter,
+	# content filters
+	'content': ContentFilter,
 	# time filters
 	'after': AfterFilter,
 	'before': BeforeFilter
@@ -0,0 +1,154 @@
+import hashlib, os, re, struct
+
+from array import array
+from collections import defaultdict
+
+from lib.parsers import hash_file_range
+from lib.snapshot import *
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+INDEX_MAGIC = b'CHOKIDX\x00'
+INDEX_VERSION = 1
+# magic, version, source size, source mtime (ns), indexed offset, SHA-256 of indexed prefix, number of clippings
+INDEX_HEADER = struct.Struct('<8sHqqq32sq')
+
+def tokenize(text):
+	return TOKEN_PATTERN.findall(text.lower())
+
+def get_clipping_text(clipping):
+	# merged clippings are searched across all of their contents
+	if clipping.is_merged():
+		return ' '.join(get_clipping_text(content) for content in clipping.content)
+	return clipping.content or ''
+
+
+class InvertedIndex:
+	'''Maps lowercase tokens to the ids of all clippings in a clippings file whose contents contain them.
+
+	Clippings are identified by the byte offset at which their record starts, which stays valid when
+	clippings are appended, so that the parser can read selected clippings directly. The index also
+	keeps the documents in order of their first clipping and the size, modification time, offset and a
+	hash of the part of the file it was built from, so that appended clippings can be added incrementally.
+	'''
+	def __init__(self):
+		self.postings = defaultdict(lambda: array('q'))
+		self.doc_keys = []
+		self.count = 0
+		self.size, self.mtime_ns, self.offset, self.digest = -1, -1, 0, None
+
+	def __repr__(self):
+		return '<InvertedIndex: %d tokens, %d clippings, up to byte %d>' % (len(self.postings), self.count, self.offset)
+
+	def add(self, clip_id, content):
+		for token in set(tokenize(content)):
+			self.postings[token].append(clip_id)
+		self.count += 1
+
+	def search(self, tokens):
+		'''Returns the ids of all clippings which contain every token.
+
+		Returns:
+			list: [clipping id, ...] in file order
+		'''
+		# intersect the smallest posting lists first
+		postings = sorted((self.postings.get(token, ()) for token in set(tokens)), key=len)
+		if len(postings) == 0:
+			return []
+		return sorted(set(postings[0]).intersection(*postings[1:]))
+
+	def update(self, path, parser):
+		'''Adds all clippings appended to the file since the last update (or rebuilds the index if the file changed).
+
+		Returns:
+			bool: whether the index has changed
+		'''
+		# skip hashing if the file is unchanged since the last update
+		stat = os.stat(path)
+		if (stat.st_size == self.size) and (stat.st_mtime_ns == self.mtime_ns):
+			return False
+		# check whether the indexed part of the file is unchanged and rebuild the index from scratch if it has changed
+		hasher = hash_file_range(path, 0, self.offset) if self.offset <= stat.st_size else None
+		if (hasher is None) or ((self.digest is not None) and (hasher.digest() != self.digest)):
+			self.postings, self.doc_keys, self.count, self.offset = defaultdict(lambda: array('q')), [], 0, 0
+			hasher = hashlib.sha256()
+		known_doc_keys = set(self.doc_keys)
+		# each clipping starts where the previous one ended
+		start_offset = clip_id = self.offset
+		for offset, doc_key, clipping in parser.iter_records(path, start_offset):
+			self.add(clip_id, clipping.content)
+			if doc_key not in known_doc_keys:
+				self.doc_keys.append(doc_key)
+				known_doc_keys.add(doc_key)
+			clip_id = offset
+		self.size, self.mtime_ns, self.offset = stat.st_size, stat.st_mtime_ns, clip_id
+		self.digest = hash_file_range(path, start_offset, self.offset, hasher=hasher).digest()
+		return True
+
+	def save(self, path):
+		'''Stores the index in a compact binary format (see save_snapshot).
+
+		Tokens, titles and authors are stored in string tables, the ids of each token's clippings as
+		consecutive ranges of a single integer column.
+		'''
+		tokens = sorted(self.postings)
+		postings, posting_offsets = array('q'), [0]
+		for token in tokens:
+			postings.extend(self.postings[token])
+			posting_offsets.append(len(postings))
+		# write to a temporary file first, so an interrupted run keeps the previous index
+		with open(path + '.tmp', 'wb') as fp:
+			fp.write(INDEX_HEADER.pack(
+				INDEX_MAGIC, INDEX_VERSION, self.size, self.mtime_ns, self.offset, self.digest or bytes(32), self.count
+			))
+			write_strings(fp, [title for title, _ in self.doc_keys])
+			write_strings(fp, [author or '' for _, author in self.doc_keys])
+			write_column(fp, [NONE_VALUE if author is None else 0 for _, author in self.doc_keys])
+			write_strings(fp, tokens)
+			write_column(fp, posting_offsets)
+			write_column(fp, postings)
+		os.replace(path + '.tmp', path)
+
+	@classmethod
+	def load(cls, path):
+		'''Loads an index stored using save.
+
+		Raises:
+			ValueError: if the file is not a (compatible) index
+		'''
+		index = cls()
+		with open(path, 'rb') as fp:
+			header = fp.read(INDEX_HEADER.size)
+			if len(header) != INDEX_HEADER.size:
+				raise ValueError(f"'{path}' is not an index.")
+			magic, version, index.size, index.mtime_ns, index.offset, index.digest, index.count = INDEX_HEADER.unpack(header)
+			if (magic != INDEX_MAGIC) or (version != INDEX_VERSION):
+				raise ValueError(f"'{path}' is not an index of version {INDEX_VERSION}.")
+			titles, authors, author_flags = read_strings(fp), read_strings(fp), read_column(fp)
+			index.doc_keys = [(title, None if flag == NONE_VALUE else author) for title, author, flag in zip(titles, authors, author_flags)]
+			tokens, posting_offsets, postings = read_strings(fp), read_column(fp), read_column(fp)
+			if (len(posting_offsets) != len(tokens) + 1) or (posting_offsets[-1] != len(postings)):
+				raise ValueError(f"'{path}' is corrupted.")
+		for token, start, end in zip(tokens, posting_offsets, posting_offsets[1:]):
+			index.postings[token] = postings[start:end]
+		return index
+
+def update_index(clippings_path, parser, index_path=None, verbose=False):
+	'''Loads, updates and stores the index of a clippings file (default: next to the file as '<clippings>.index').
+
+	Indices which can't be loaded (e.g. of a previous version) are rebuilt.
+
+	Returns:
+		InvertedIndex: index of the entire clippings file
+	'''
+	index_path = index_path or (clippings_path + '.index')
+	index = InvertedIndex()
+	if os.path.exists(index_path):
+		try:
+			index = InvertedIndex.load(index_path)
+		except (OSError, ValueError, struct.error) as err:
+			if verbose: print(f"Index:\n  Could not load '{index_path}' ({err}). Rebuilding it.")
+	# only rewrite the index if it has changed
+	if index.update(clippings_path, parser):
+		index.save(index_path)
+	return index
@@ -0,0 +1,97 @@
+class SuffixAutomaton:
+	'''Automaton recognizing all substrings of a text, built in linear time and space.
+
+	Each state represents a set of substrings which share the same end positions in the text.
+	Besides the transitions, the automaton stores how often these substrings occur in the text
+	and where their first occurrence ends.
+	'''
+	def __init__(self, text):
+		self.text = text
+		# state 0 is the root (empty string)
+		self.transitions = [{}]
+		self.links = [-1]
+		self.lengths = [0]
+		self.end_idcs = [-1]
+		self.counts = [0]
+
+		transitions, links, lengths, end_idcs, counts = self.transitions, self.links, self.lengths, self.end_idcs, self.counts
+		last = 0
+		for char_idx, char in enumerate(text):
+			# add state for the prefix ending at the current character
+			cur = len(lengths)
+			transitions.append({})
+			links.append(0)
+			lengths.append(lengths[last] + 1)
+			end_idcs.append(char_idx)
+			counts.append(1)
+			# add transitions to the new state from all suffixes lacking one
+			state = last
+			while (state != -1) and (char not in transitions[state]):
+				transitions[state][char] = cur
+				state = links[state]
+			if state != -1:
+				next_state = transitions[state][char]
+				if lengths[state] + 1 == lengths[next_state]:
+					links[cur] = next_state
+				# split the next state by cloning it for the shorter substrings
+				else:
+					clone = len(lengths)
+					transitions.append(dict(transitions[next_state]))
+					links.append(links[next_state])
+					lengths.append(lengths[state] + 1)
+					end_idcs.append(end_idcs[next_state])
+					counts.append(0)
+					while (state != -1) and (transitions[state].get(char) == next_state):
+						transitions[state][char] = clone
+						state = links[state]
+					links[next_state] = clone
+					links[cur] = clone
+			last = cur
+
+		# propagate occurrence counts along suffix links, starting from the longest states
+		for state in sorted(range(1, len(lengths)), key=lengths.__getitem__, reverse=True):
+			counts[links[state]] += counts[state]
+
+	def __repr__(self):
+		return f'<SuffixAutomaton: {len(self.text)} characters, {len(self.lengths)} states>'
+
+	def iter_matches(self, query):
+		'''Computes the longest substring of the text ending at each position of the query.
+
+		Returns:
+			generator: (query end index, match length, state), ...
+		'''
+		transitions, links, lengths = self.transitions, self.links, self.lengths
+		state, length = 0, 0
+		for query_idx, char in enumerate(query):
+			# shorten the current match until it can be extended by the character
+			while state and (char not in transitions[state]):
+				state = links[state]
+				length = lengths[state]
+			if char in transitions[state]:
+				state = transitions[state][char]
+				length += 1
+			yield query_idx, length, state
+
+	def find_longest_unique(self, query, min_len=0):
+		'''Finds the longest substring of the query which occurs in the text.
+
+		If multiple substrings of this length occur, the first one occurring exactly once is returned.
+		If all of them occur more than once, the match is ambiguous and None is returned.
+
+		Returns:
+			tuple: (query start index, text start index, length) or None
+		'''
+		best_len, best_match = 0, None
+		for query_idx, length, state in self.iter_matches(query):
+			# the substring of the current match length occurs as often as its state
+			if length > best_len:
+				best_len = length
+				best_match = (query_idx, state) if self.counts[state] == 1 else None
+			elif (length == best_len) and (best_match is None) and (self.counts[state] == 1):
+				best_match = (query_idx, state)
+
+		if (best_match is None) or (best_len <= min_len):
+			return None
+		query_idx, state = best_match
+		return query_idx - best_len + 1, self.end_idcs[state] - best_len + 1, best_len
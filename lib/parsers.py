@@ -1,46 +1,296 @@
-import re
+import functools, hashlib, mmap, os, re, struct
+
+from concurrent.futures import ProcessPoolExecutor
 
 from lib.data import *
+from lib.snapshot import *
+
+# precompiled clipping patterns
+TITLE_AUTHOR_PATTERN = re.compile(r'(.+) \((.+, .+)\)')
+TYPE_PATTERN = re.compile(r'- Your (.+?) on')
+POSITION_PATTERN = re.compile(r'.+?(page ([\w\d\-]+) \| )?([Ll]ocation ([\d\-]+) \| )?(Added.+)')
+PAGE_CLEANUP_PATTERN = re.compile(r'[^\d\-]')
+
+KINDLE_DATETIME_FORMAT = 'Added on %A, %B %d, %Y %I:%M:%S %p'
+WEEKDAYS = {'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'}
+MONTH_MAP = {
+	'January': 1, 'February': 2, 'March': 3, 'April': 4, 'May': 5, 'June': 6,
+	'July': 7, 'August': 8, 'September': 9, 'October': 10, 'November': 11, 'December': 12
+}
+
+@functools.lru_cache(maxsize=4096)
+def _parse_kindle_date(date_str):
+	'''Parses 'Monday, January 6, 2020' into (year, month, day).'''
+	weekday, month_day, year = date_str.split(', ')
+	month, day = month_day.split(' ')
+	if (weekday not in WEEKDAYS) or (len(day) > 2) or (len(year) != 4) or not (day.isdigit() and year.isdigit()):
+		raise ValueError(f"Unknown date format '{date_str}'.")
+	year, month, day = int(year), MONTH_MAP[month], int(day)
+	# validate day of month
+	datetime.date(year, month, day)
+	return year, month, day
+
+def parse_kindle_datetime(datetime_str):
+	'''Parses 'Added on Monday, January 6, 2020 10:13:17 PM' into a datetime.
+
+	Equivalent to datetime.datetime.strptime(datetime_str, KINDLE_DATETIME_FORMAT), but splits the
+	string directly and caches the date part, as many clippings are added on the same day. Strings
+	which do not follow the English Kindle format are passed on to strptime.
+	'''
+	try:
+		if not datetime_str.startswith('Added on '):
+			raise ValueError(f"Unknown datetime format '{datetime_str}'.")
+		date_str, time_str, meridiem = datetime_str[9:].rsplit(' ', 2)
+		year, month, day = _parse_kindle_date(date_str)
+		hour, minute, second = time_str.split(':')
+		if (meridiem not in ('AM', 'PM')) or not all([t.isdigit() and len(t) <= 2 for t in (hour, minute, second)]):
+			raise ValueError(f"Unknown time format '{time_str} {meridiem}'.")
+		hour = int(hour)
+		if not (1 <= hour <= 12):
+			raise ValueError(f"Hour {hour} is out of range.")
+		hour = hour % 12 + (12 if meridiem == 'PM' else 0)
+		return datetime.datetime(year, month, day, hour, int(minute), int(second))
+	except (KeyError, ValueError):
+		return datetime.datetime.strptime(datetime_str, KINDLE_DATETIME_FORMAT)
+
+def collect_clippings_paths(paths):
+	'''Collects clippings files from a list of files and directories (searched recursively for '.txt' files).
+
+	Returns:
+		list: ['path/to/clippings', ...]
+	'''
+	clippings_paths = []
+	for path in paths:
+		if not os.path.isdir(path):
+			clippings_paths.append(path)
+			continue
+		for root, dirnames, filenames in os.walk(path):
+			dirnames.sort()
+			clippings_paths += [os.path.join(root, filename) for filename in sorted(filenames) if filename.lower().endswith('.txt')]
+	assert len(clippings_paths) > 0, f"[Error] No clippings files found in {', '.join(paths)}."
+	return clippings_paths
+
+# size of blocks read when hashing clippings files
+HASH_BLOCK_SIZE = 1 << 20
+# minimum number of bytes per chunk when parsing in parallel
+MIN_CHUNK_SIZE = 1 << 20
+
+def hash_file_range(path, start=0, end=None, hasher=None):
+	'''Updates (or creates) a SHA-256 hasher with the bytes in [start, end) of a file.'''
+	hasher = hashlib.sha256() if hasher is None else hasher
+	with open(path, 'rb') as fp:
+		fp.seek(start)
+		remaining = (os.path.getsize(path) if end is None else end) - start
+		while remaining > 0:
+			block = fp.read(min(HASH_BLOCK_SIZE, remaining))
+			if not block:
+				break
+			hasher.update(block)
+			remaining -= len(block)
+	return hasher
+
+
+def _parse_range(parser_class, path, start, end):
+	# parse a byte range in a worker process and return plain tuples, which are much cheaper to transfer than objects
+	return [
+		(offset, doc_key, c.page, c.location, c.datetime, c.content, c.clip_type)
+		for offset, doc_key, c in parser_class()._iter_range(path, start, end)
+	]
+
 
 class KindleParser:
-	def __init__(self, verbose=False):
+	def __init__(self, verbose=False, jobs=1):
 		self.verbose = verbose
+		self.jobs = jobs
 
-	def parse(self, path):
+	def parse(self, path, checkpoint=None):
 		'''Returns a dict of clippings sorted by title.
 
+		If a checkpoint path is provided, previously parsed documents are loaded from its binary
+		snapshot and only the clippings appended after the last checkpointed separator are parsed.
+		The checkpoint is then updated to the end of the last complete clipping.
+
 		Returns:
 			dict: {('title', 'author'): Document, ...}
 		'''
 		# set up output datastructures
-		documents = {}
-		stats = defaultdict(int)
+		documents, offset, hasher, unchanged = {}, 0, None, False
+		if checkpoint:
+			documents, offset, hasher, unchanged = self._load_checkpoint(checkpoint, path)
+		start_offset = offset
+
+		if not unchanged:
+			for offset, doc_key, clipping in self.iter_records(path, start_offset):
+				add_to_documents(documents, doc_key, clipping)
+
+		# store documents and offset of the last complete clipping
+		if checkpoint and not unchanged:
+			hasher = hash_file_range(path, start_offset, offset, hasher=hasher)
+			self._save_checkpoint(checkpoint, path, documents, offset, hasher)
+
+		# print stats
+		if self.verbose:
+			self._print_statistics("'%s'" % path, documents)
+
+		return documents
 
-		with open(path, 'r', encoding='utf8') as cf:
+	def parse_files(self, paths):
+		'''Returns a dict of clippings from multiple files (e.g. from different devices).
+
+		Clippings which are identical to a clipping in a previous file are skipped based on their fingerprints,
+		while identical clippings within the same file are kept. Files are parsed in parallel if multiple jobs are set.
+
+		Returns:
+			dict: {('title', 'author'): Document, ...}
+		'''
+		stats = {}
+		documents = collect_documents(self.iter_files_clippings(paths, stats=stats))
+
+		# print stats
+		if self.verbose:
+			self._print_statistics('%d files' % len(paths), documents, stats)
+
+		return documents
+
+	def iter_clippings(self, path):
+		'''Yields clippings one at a time as soon as their separator has been read.
+
+		Returns:
+			generator: (('title', 'author'), Clipping), ...
+		'''
+		for _, doc_key, clipping in self.iter_records(path):
+			yield doc_key, clipping
+
+	def iter_files_clippings(self, paths, stats=None):
+		'''Yields the unique clippings of multiple files in file order (see parse_files).
+
+		Returns:
+			generator: (('title', 'author'), Clipping), ...
+		'''
+		yield from iter_unique_clippings(self._iter_files_records(paths), stats=stats)
+
+	def _iter_files_records(self, paths):
+		'''Yields a stream of clippings for each file in file order.
+
+		Returns:
+			generator: [(('title', 'author'), Clipping), ...], ...
+		'''
+		# parse files sequentially (each potentially in parallel chunks) if there is nothing to parallelize
+		if (self.jobs < 2) or (len(paths) < 2):
+			for path in paths:
+				yield self.iter_clippings(path)
+			return
+		# parse entire files in worker processes and yield their clippings in file order
+		with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+			results = executor.map(_parse_range, [type(self)] * len(paths), paths, [0] * len(paths), [None] * len(paths))
+			for records in results:
+				yield (
+					(doc_key, Clipping(page=page, location=location, datetime=date_time, content=content, clip_type=clip_type))
+					for _, doc_key, page, location, date_time, content, clip_type in records
+				)
+
+	def _print_statistics(self, source, documents, stats=None):
+		print("Statistics (%s):" % source)
+		stats = defaultdict(int, stats or {})
+		for document in documents.values():
+			for clipping in document.get_clippings():
+				stats[clipping.clip_type] += 1
+		stats['document'] = len(documents.keys())
+		for stat in sorted(stats):
+			print('  %d %s%s' % (stats[stat], stat.title(), '' if stats[stat] == 1 else 's'))
+
+	def iter_records(self, path, start=0):
+		'''Yields all complete clippings after the start offset, parsing chunks in parallel if multiple jobs are set.
+
+		Returns:
+			generator: (offset after separator, ('title', 'author'), Clipping), ...
+		'''
+		ranges = self._split_range(path, start)
+		if len(ranges) < 2:
+			yield from self._iter_range(path, start)
+			return
+		# parse chunks in worker processes and yield their clippings in file order
+		with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+			results = executor.map(
+				_parse_range,
+				[type(self)] * len(ranges), [path] * len(ranges),
+				[r[0] for r in ranges], [r[1] for r in ranges]
+			)
+			for records in results:
+				for offset, doc_key, page, location, date_time, content, clip_type in records:
+					yield offset, doc_key, Clipping(page=page, location=location, datetime=date_time, content=content, clip_type=clip_type)
+
+	def iter_records_at(self, path, offsets):
+		'''Yields the first complete clipping after each offset (e.g. clippings selected using an index).
+
+		Returns:
+			generator: (offset after separator, ('title', 'author'), Clipping), ...
+		'''
+		for offset in offsets:
+			for record in self._iter_range(path, offset):
+				yield record
+				break
+
+	def _split_range(self, path, start=0):
+		'''Splits the file after the start offset into byte ranges which end directly after a separator.
+
+		Returns:
+			list: [(start, end), ...]
+		'''
+		size = os.path.getsize(path)
+		num_chunks = min(self.jobs * 4, (size - start) // MIN_CHUNK_SIZE)
+		if (self.jobs < 2) or (num_chunks < 2):
+			return [(start, None)]
+
+		boundaries = [start]
+		with open(path, 'rb') as cf:
+			for chunk_idx in range(1, num_chunks):
+				cf.seek(max(boundaries[-1], start + ((size - start) * chunk_idx) // num_chunks))
+				# skip the (potentially partial) current line
+				cf.readline()
+				# advance to the end of the next separator line
+				for line in iter(cf.readline, b''):
+					if line.replace(b'\xef\xbb\xbf', b'').strip() == b'==========':
+						boundaries.append(cf.tell())
+						break
+				if boundaries[-1] >= size:
+					break
+		boundaries = [b for b in boundaries if b < size]
+		return [(range_start, range_end) for range_start, range_end in zip(boundaries, boundaries[1:] + [None])]
+
+	def _iter_range(self, path, start=0, end=None):
+		'''Yields complete clippings within a byte range of the clippings file.
+
+		Clippings are complete once their separator line, including its line break, has been written.
+
+		Returns:
+			generator: (offset after separator, ('title', 'author'), Clipping), ...
+		'''
+		with open(path, 'rb') as cf:
+			cf.seek(start)
+			offset = start
 			clip_line = 0
-			for line in cf:
-				line = line.replace('\ufeff', '').strip()
+			for raw_line in cf:
+				offset += len(raw_line)
+				line = raw_line.decode('utf8').replace('\ufeff', '').strip()
 				# end of clipping
 				if line == '==========':
-					if clip_line > 0:
-						# add document to output dictionary if new
-						doc_key = (title, author)
-						if doc_key not in documents:
-							documents[doc_key] = Document(title, author)
-						# add clipping to document
-						documents[doc_key].add_clipping(
-							Clipping(
+					# separators without a line break may still be written to (e.g. by the Kindle), so they are read again later
+					if not raw_line.endswith(b'\n'):
+						break
+					if clip_line > 1:
+						yield (offset, (title, author), Clipping(
 								page=page,
 								location=location,
 								datetime=date_time,
 								content=clip_content,
 								clip_type=clip_type
-							)
-						)
-						# add to stats
-						stats[clip_type] += 1
+							))
 					# reset clipping line counter
 					clip_line = 0
+					# stop at the end of the range
+					if (end is not None) and (offset >= end):
+						break
 					continue
 				# skip if irrelevant
 				if clip_line < 0:
@@ -48,52 +298,18 @@ class KindleParser:
 
 				# parse title
 				if clip_line == 0:
-					title_author_match = re.match(r'(.+) \((.+, .+)\)', line)
-					if title_author_match:
-						title = title_author_match.group(1).strip()
-						author = title_author_match.group(2)
-					else:
-						title = line.strip()
-						author = None
+					title, author = self._parse_title(line)
 
 				# parse type and position
 				if clip_line == 1:
-					# parse clipping type
-					type_match = re.match(r'- Your (.+?) on', line)
+					metadata = self._parse_metadata(line)
 					# skip if unknown
-					if not type_match:
+					if metadata is None:
 						clip_line = -1
 						continue
-					clip_type = type_match.group(1).lower()
-
-					# parse position
-					position_match = re.match(r'.+?(page ([\w\d\-]+) \| )?([Ll]ocation ([\d\-]+) \| )?(Added.+)', line)
-					if position_match:
-						# parse page to start and end integers
-						page = None
-						# if page string was found and it contains any digit (i.e. exclude 'page VI')
-						if position_match.group(2) and any([c.isdigit() for c in position_match.group(2)]):
-							page = position_match.group(2)
-							# remove any strings besides '-'
-							page = re.sub(r'[^\d\-]', '', page)
-							if '-' in page:
-								page_start = int(page.split('-')[0])
-								page_end = int(page.split('-')[1])
-							else:
-								page_start, page_end = int(page), int(page)
-							page = (page_start, page_end)
-						# parse location to start and end integers
-						location = position_match.group(4)
-						if location:
-							if '-' in location:
-								location_start = int(location.split('-')[0])
-								location_end = int(location.split('-')[1])
-							else:
-								location_start, location_end = int(location), int(location)
-							location = (location_start, location_end)
-
-						# parse datetime
-						date_time = datetime.datetime.strptime(position_match.group(5), 'Added on %A, %B %d, %Y %I:%M:%S %p')
+					clip_type, page, location, date_time = metadata
+					# clippings without content (e.g. bookmarks) may end early
+					clip_content = ''
 
 				# parse clipping content
 				if clip_line == 3:
@@ -102,16 +318,170 @@ class KindleParser:
 				# increment clipping internal counter
 				clip_line += 1
 
-		# print stats
-		if self.verbose:
-			print("Statistics ('%s'):" % path)
-			stats['document'] = len(documents.keys())
-			for stat in sorted(stats):
-				print('  %d %s%s' % (stats[stat], stat.title(), '' if stats[stat] == 1 else 's'))
+	def _parse_title(self, line):
+		'''Parses 'Title (Lastname, Name)' into ('Title', 'Lastname, Name') or ('Title', None).'''
+		title_author_match = TITLE_AUTHOR_PATTERN.match(line)
+		if title_author_match:
+			return title_author_match.group(1).strip(), title_author_match.group(2)
+		return line.strip(), None
 
-		return documents
+	def _parse_metadata(self, line):
+		'''Parses '- Your TYPE on page X | Location Y-Z | Added on DATETIME'.
+
+		Returns:
+			tuple: ('type', (START, END) or None, (START, END) or None, datetime or None) or None if the type is unknown
+		'''
+		# parse clipping type
+		type_match = TYPE_PATTERN.match(line)
+		if not type_match:
+			return None
+		clip_type = type_match.group(1).lower()
+
+		# parse position
+		page, location, date_time = None, None, None
+		position_match = POSITION_PATTERN.match(line)
+		if position_match:
+			# if page string was found and it contains any digit (i.e. exclude 'page VI')
+			if position_match.group(2) and any([c.isdigit() for c in position_match.group(2)]):
+				page = position_match.group(2)
+				# remove any strings besides '-'
+				page = PAGE_CLEANUP_PATTERN.sub('', page)
+				if '-' in page:
+					page_start = int(page.split('-')[0])
+					page_end = int(page.split('-')[1])
+				else:
+					page_start, page_end = int(page), int(page)
+				page = (page_start, page_end)
+			# parse location to start and end integers
+			location = position_match.group(4)
+			if location:
+				if '-' in location:
+					location_start = int(location.split('-')[0])
+					location_end = int(location.split('-')[1])
+				else:
+					location_start, location_end = int(location), int(location)
+				location = (location_start, location_end)
+
+			# parse datetime
+			date_time = parse_kindle_datetime(position_match.group(5))
+
+		return clip_type, page, location, date_time
+
+	def _load_checkpoint(self, checkpoint, path):
+		'''Loads documents from a checkpoint snapshot if the clippings file still starts with the checkpointed bytes.
+
+		If size and modification time of the file match the snapshot, it is used without hashing the file.
+
+		Returns:
+			tuple: ({('title', 'author'): Document, ...}, offset, hasher or None, whether the file is unchanged)
+		'''
+		if not os.path.exists(checkpoint):
+			return {}, 0, None, False
+		try:
+			documents, source = load_snapshot(checkpoint)
+		except (OSError, ValueError, struct.error) as err:
+			if self.verbose: print(f"Checkpoint:\n  Could not load '{checkpoint}' ({err}). Parsing from scratch.")
+			return {}, 0, None, False
+		# skip hashing if the file is unchanged since the snapshot
+		stat = os.stat(path)
+		if (stat.st_size == source['offset']) and (stat.st_mtime_ns == source['mtime_ns']):
+			if self.verbose: print(f"Checkpoint:\n  '{path}' is unchanged since the last checkpoint.")
+			return documents, source['offset'], None, True
+		# fall back to a full parse if the file was truncated or rewritten
+		if 0 <= source['offset'] <= stat.st_size:
+			hasher = hash_file_range(path, 0, source['offset'])
+			if hasher.digest() == source['digest']:
+				if self.verbose: print(f"Checkpoint:\n  Resuming '{path}' at byte {source['offset']}.")
+				return documents, source['offset'], hasher, False
+		if self.verbose: print(f"Checkpoint:\n  '{path}' changed before byte {source['offset']}. Parsing from scratch.")
+		return {}, 0, None, False
+
+	def _save_checkpoint(self, checkpoint, path, documents, offset, hasher):
+		stat = os.stat(path)
+		save_snapshot(checkpoint, documents, source={
+			'size': stat.st_size,
+			'mtime_ns': stat.st_mtime_ns,
+			'offset': offset,
+			'digest': hasher.digest()
+		})
+
+
+class KindleMmapParser(KindleParser):
+	'''KindleParser which memory-maps the clippings file and only decodes the lines it needs.
+
+	Separators are located using bytes.find, after which only the title, metadata and content
+	lines of each clipping are decoded. Lines which are skipped (e.g. the empty line after the
+	metadata or clippings of unknown types) are never converted to strings.
+	'''
+	def _iter_range(self, path, start=0, end=None):
+		with open(path, 'rb') as cf:
+			size = os.fstat(cf.fileno()).st_size
+			# empty files can't be mapped
+			if size <= start:
+				return
+			with mmap.mmap(cf.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+				clip_start = start
+				search_idx = start
+				while True:
+					sep_idx = mm.find(b'==========', search_idx)
+					if sep_idx < 0:
+						break
+					# determine the surrounding line
+					line_start = mm.rfind(b'\n', clip_start, sep_idx) + 1 or clip_start
+					line_end = mm.find(b'\n', sep_idx)
+					# separators without a line break may still be written to (e.g. by the Kindle), so they are read again later
+					if line_end < 0:
+						break
+					next_start = line_end + 1
+					search_idx = next_start
+					# skip separator strings which are not on a line of their own (checking bytes first, decoding only if unclear)
+					if (line_start != sep_idx) or mm[sep_idx + 10:next_start].strip():
+						if self._decode(mm, line_start, next_start) != '==========':
+							continue
+
+					# parse the clipping between the previous and the current separator
+					clipping = self._parse_clipping_bytes(mm, clip_start, line_start)
+					if clipping is not None:
+						yield (next_start, *clipping)
+					clip_start = next_start
+					# stop at the end of the range
+					if (end is not None) and (next_start >= end):
+						break
+
+	def _parse_clipping_bytes(self, mm, start, end):
+		# find the ends of the title, metadata and empty lines
+		title_end = mm.find(b'\n', start, end) + 1
+		meta_end = mm.find(b'\n', title_end, end) + 1 if title_end > 0 else 0
+		# clippings require at least a title and metadata
+		if meta_end <= 0:
+			return None
+
+		metadata = self._parse_metadata(self._decode(mm, title_end, meta_end))
+		if metadata is None:
+			return None
+		clip_type, page, location, date_time = metadata
+		title, author = self._parse_title(self._decode(mm, start, title_end))
+
+		# decode the first content line after the empty line (if available)
+		clip_content = ''
+		empty_end = mm.find(b'\n', meta_end, end) + 1
+		if 0 < empty_end < end:
+			content_end = mm.find(b'\n', empty_end, end) + 1 or end
+			clip_content = self._decode(mm, empty_end, content_end)
+
+		return (title, author), Clipping(
+				page=page,
+				location=location,
+				datetime=date_time,
+				content=clip_content,
+				clip_type=clip_type
+			)
+
+	def _decode(self, mm, start, end):
+		return mm[start:end].decode('utf8').replace('\ufeff', '').strip()
 
 # name to constructor map
 PARSER_MAP = {
-	'kindle': KindleParser
+	'kindle': KindleParser,
+	'kindle-mmap': KindleMmapParser
 }
@@ -0,0 +1,404 @@
+import hashlib, json, os, re, sys, time
+
+from concurrent.futures import ProcessPoolExecutor
+
+from lib.data import *
+from lib.exporters import *
+from lib.filters import *
+from lib.index import *
+from lib.parsers import *
+from lib.profiling import *
+
+# characters which are replaced in output filenames
+FILENAME_CLEANUP_PATTERN = re.compile(r'[^\w\-.,()\' ]')
+# name of the file storing hashes of documents exported to an output directory
+MANIFEST_FILENAME = '.chokitto-manifest.json'
+# maximum number of UTF-8 bytes of output filenames (most filesystems allow 255) and bytes reserved for numbering, e.g. ' (2)'
+FILENAME_MAX_BYTES = 240
+FILENAME_NUMBER_BYTES = 12
+
+def get_document_filename(doc_key, extension, taken=()):
+	# e.g. 'Title (Lastname, Name).md', numbered if the (lowercase) filename is already taken by another document
+	title, author = doc_key
+	name = FILENAME_CLEANUP_PATTERN.sub('_', f'{title} ({author})' if author else title).strip(' .')
+	# truncate the encoded name, dropping characters which were cut in the middle
+	max_bytes = FILENAME_MAX_BYTES - FILENAME_NUMBER_BYTES - len(extension.encode('utf8'))
+	name = name.encode('utf8')[:max_bytes].decode('utf8', 'ignore').strip(' .') or '_'
+	filename, number = name + extension, 1
+	while filename.lower() in taken:
+		number += 1
+		filename = f'{name} ({number}){extension}'
+	return filename
+
+def get_document_hash(doc_key, document, exporter):
+	# hash of the document's clippings and the exporter settings (e.g. date format), which determine its output
+	hasher = hashlib.blake2b(repr(exporter).encode('utf8'), digest_size=16)
+	for clipping in document.get_clippings():
+		hasher.update(get_clipping_fingerprint(doc_key, clipping))
+	return hasher.hexdigest()
+
+def _export_document(exporter, doc_key, document, path):
+	# export a single document (potentially in a worker process)
+	exporter.write({doc_key: document}, path)
+
+
+class Pipeline:
+	'''Parses, merges, filters and exports clippings files.
+
+	The parser, filters and exporter can be specified by name (as on the command line) or as instances.
+	The parser and exporter are only constructed when first needed (e.g. the exporter is never set up if
+	documents are only listed). All components are reused for subsequent files, keeping compiled
+	patterns and caches warm.
+
+	Example:
+		pipeline = Pipeline(exporter='json', filters=["type('highlight')"], merge=True)
+		for path in paths:
+			pipeline.run(path, path + '.json')
+	'''
+	def __init__(self, parser='kindle', exporter='markdown', filters=None, dedup=False, merge=False, index=False, jobs=1, verbose=False, profiler=None):
+		self.dedup = dedup
+		self.merge = merge
+		self.index = index
+		self.jobs = jobs
+		self.verbose = verbose
+		self.profiler = Profiler(enabled=False) if profiler is None else profiler
+		# parse filters immediately to report syntax errors before processing any files
+		self.filters = []
+		for filt in (filters or []):
+			self.filters += parse_filters([filt]) if isinstance(filt, str) else [filt]
+		# internal housekeeping (constructed on first access)
+		self._parser = parser
+		self._exporter = exporter
+
+	def __repr__(self):
+		return f"<Pipeline: {self._parser}{', dedup' if self.dedup else ''}{', merge' if self.merge else ''}, {len(self.filters)} filters, {self._exporter}>"
+
+	@property
+	def parser(self):
+		if isinstance(self._parser, str):
+			assert self._parser in PARSER_MAP, f"Unknown parser '{self._parser}'."
+			self._parser = PARSER_MAP[self._parser](verbose=self.verbose, jobs=self.jobs)
+		return self._parser
+
+	@property
+	def exporter(self):
+		if isinstance(self._exporter, str):
+			self._exporter = parse_exporter(self._exporter)
+			self._exporter.verbose = self.verbose
+		return self._exporter
+
+	def can_stream(self, checkpoint=None):
+		# clippings can be streamed if no documents need to be held (e.g. for merging or printing statistics)
+		return not (self.dedup or self.merge or self.verbose or checkpoint)
+
+	def parse(self, path, checkpoint=None, doc_keys=None):
+		'''Parses the documents of a clippings file (or a list of files) and postprocesses them.
+
+		Clippings which are identical to a clipping of a previous file are only added once (identical
+		clippings within a file are removed by dedup). Checkpoints require a single file. If an
+		index is used, only the clippings selected using the index are parsed (see select_clippings). If a
+		list of doc_keys is provided, the keys of all documents in the clippings file are appended to it
+		(including documents without selected clippings).
+
+		Returns:
+			dict: {('title', 'author'): Document, ...}
+		'''
+		selection = self.select_clippings(path) if checkpoint is None else None
+		with self.profiler.stage('parse') as record:
+			if selection is not None:
+				documents = collect_documents(*selection)
+			elif isinstance(path, str):
+				documents = self.parser.parse(path, checkpoint=checkpoint)
+			else:
+				assert checkpoint is None, "[Error] Checkpoints can only be used with a single clippings file."
+				documents = self.parser.parse_files(path)
+			if doc_keys is not None:
+				doc_keys.extend(documents if selection is None else selection[1])
+			record['items'] = sum(len(document.clippings) for document in documents.values())
+
+		return self.postprocess(documents)
+
+	def postprocess(self, documents):
+		'''Optionally deduplicates and merges the clippings of parsed documents (in place).
+
+		Returns:
+			dict: {('title', 'author'): Document, ...}
+		'''
+		# remove duplicate clippings (cheaply reducing the number of clippings to merge)
+		if self.dedup:
+			with self.profiler.stage('dedup') as record:
+				num_removed = sum(document.remove_duplicate_clippings() for document in documents.values())
+				record['items'] = sum(len(document.clippings) for document in documents.values())
+			if self.verbose:
+				print("Deduplication:\n  Removed %d duplicate clipping%s." % (num_removed, '' if num_removed == 1 else 's'))
+
+		# merge and deduplicate clippings
+		if self.merge:
+			with self.profiler.stage('merge') as record:
+				for title, author in documents:
+					documents[(title, author)].merge_clippings()
+					documents[(title, author)].deduplicate_clippings()
+				record['items'] = sum(len(document.clippings) for document in documents.values())
+		return documents
+
+	def filter(self, documents):
+		'''Applies the filters to parsed documents.
+
+		Returns:
+			dict: {('title', 'author'): DocumentView, ...} or the unchanged documents if there are no filters
+		'''
+		if not self.filters:
+			return documents
+		# print filters
+		if self.verbose:
+			print("Filters (%d total):" % len(self.filters))
+			for filt in self.filters:
+				print("  %s" % filt)
+		# apply filters
+		with self.profiler.stage('filter') as record:
+			documents = apply_filters(documents, self.filters)
+			record['items'] = sum(len(document.clippings) for document in documents.values())
+		return documents
+
+	def get_documents(self, path, checkpoint=None, doc_keys=None):
+		'''Parses, merges and filters the documents of a clippings file (see parse for doc_keys).
+
+		Returns:
+			dict: {('title', 'author'): Document, ...}
+		'''
+		return self.filter(self.parse(path, checkpoint=checkpoint, doc_keys=doc_keys))
+
+	def iter_clippings(self, path, doc_keys=None):
+		'''Lazily parses and filters the clippings of a file (or a list of files) without collecting them into documents.
+
+		If a list of doc_keys is provided, the keys of all parsed documents are appended to it in the order
+		they appear (see filter_clippings), so that exporters can keep the order of the unfiltered documents.
+
+		Returns:
+			generator: (('title', 'author'), Clipping), ...
+		'''
+		assert not self.merge, "[Error] Clippings can't be merged while streaming."
+		selection = self.select_clippings(path)
+		if selection is not None:
+			clippings, selected_doc_keys = selection
+			if doc_keys is not None:
+				doc_keys.extend(selected_doc_keys)
+			return filter_clippings(clippings, self.filters)
+		clippings = self.parser.iter_clippings(path) if isinstance(path, str) else self.parser.iter_files_clippings(path)
+		if self.filters:
+			clippings = filter_clippings(clippings, self.filters, doc_keys=doc_keys)
+		return clippings
+
+	def check_output(self, output=None, output_dir=None):
+		'''Checks whether the exporter can write to an output (default: STDOUT) or to an output directory, e.g. before any clippings are parsed.'''
+		if output_dir is not None:
+			# annotated PDFs are matched to their source PDFs by the exporter itself
+			assert not isinstance(self.exporter, PdfMergeExporter), f"[Error] {self.exporter} can't export documents to separate files (use a directory of PDFs and -o instead)."
+			return
+		assert isinstance(output, str) or self.exporter.dumps, f"[Error] {self.exporter} can only write to a file (use -o)."
+
+	def export(self, source, output=None, doc_keys=None):
+		'''Exports documents or a stream of clippings to a path or file object (default: STDOUT).
+
+		Streamed clippings are parsed, filtered and exported in a single stage. Their documents are ordered
+		by the doc_keys collected while streaming (see iter_clippings).
+		'''
+		self.check_output(output)
+		streaming = not isinstance(source, dict)
+		output = sys.stdout if output is None else output
+		with self.profiler.stage('stream' if streaming else 'export') as record:
+			if streaming:
+				source = self.profiler.iter_counted(source, record)
+			else:
+				record['items'] = sum(len(document.clippings) for document in source.values())
+			# write to path
+			if isinstance(output, str):
+				if streaming:
+					self.exporter.write_clippings(source, output, doc_keys=doc_keys)
+				else:
+					self.exporter.write(source, output)
+			# write to file object
+			else:
+				if streaming:
+					self.exporter.dump_clippings(source, output, doc_keys=doc_keys)
+				else:
+					self.exporter.dump(source, output)
+
+	def run(self, path, output=None, checkpoint=None):
+		'''Runs all stages on a clippings file, streaming the clippings if possible.'''
+		doc_keys = []
+		if self.can_stream(checkpoint=checkpoint):
+			source = self.iter_clippings(path, doc_keys=doc_keys)
+		else:
+			source = self.get_documents(path, checkpoint=checkpoint)
+		self.export(source, output, doc_keys=doc_keys)
+
+	def export_documents(self, documents, output_dir, doc_keys=None):
+		'''Exports each document to its own file in the output directory (named after its title and author).
+
+		A manifest in the output directory stores the document of each file together with a hash of its
+		clippings and the exporter's settings. Documents whose hash is unchanged (and whose file still exists)
+		are skipped without being rendered. The remaining documents are exported in parallel if multiple jobs
+		are set. Documents whose filenames would collide are numbered and keep their filenames in later runs.
+
+		If the keys of all parsed documents are provided as doc_keys, files of previously exported documents
+		which are not among them anymore (e.g. because they were removed from the clippings file) are deleted.
+		Files of documents which were only filtered out are kept.
+
+		Returns:
+			tuple: (['path/to/output', ...] of the files which were written, ['path/to/output', ...] of the files which were removed)
+		'''
+		self.check_output(output_dir=output_dir)
+		os.makedirs(output_dir, exist_ok=True)
+		manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+		manifest = {} # {'filename': {'title': 'title', 'author': 'author', 'hash': 'hash'}}
+		if os.path.exists(manifest_path):
+			with open(manifest_path, 'r', encoding='utf8') as file:
+				manifest = json.load(file)
+		doc_keys = None if doc_keys is None else set(doc_keys)
+		# filenames of previously exported documents and all filenames which are taken
+		filenames = {((entry['title'], entry['author']), os.path.splitext(filename)[1]): filename for filename, entry in manifest.items()}
+		taken = {filename.lower() for filename in manifest}
+
+		with self.profiler.stage('export') as record:
+			# collect documents which changed since they were last exported
+			tasks = []
+			for doc_key in sorted(documents):
+				filename = filenames.get((doc_key, self.exporter.extension))
+				if filename is None:
+					filename = get_document_filename(doc_key, self.exporter.extension, taken)
+					taken.add(filename.lower())
+				path = os.path.join(output_dir, filename)
+				document_hash = get_document_hash(doc_key, documents[doc_key], self.exporter)
+				if (manifest.get(filename, {}).get('hash') == document_hash) and os.path.exists(path):
+					continue
+				manifest[filename] = {'title': doc_key[0], 'author': doc_key[1], 'hash': document_hash}
+				tasks.append((doc_key, documents[doc_key], path))
+				record['items'] += len(documents[doc_key].clippings)
+
+			# remove files of documents which are not exported anymore
+			removed_paths = []
+			for filename, entry in list(manifest.items()):
+				doc_key = (entry['title'], entry['author'])
+				if (doc_keys is None) or (doc_key in doc_keys):
+					continue
+				del manifest[filename]
+				path = os.path.join(output_dir, filename)
+				if os.path.exists(path):
+					os.remove(path)
+				removed_paths.append(path)
+
+			# render and write documents in worker processes
+			if (self.jobs > 1) and (len(tasks) > 1):
+				with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+					list(executor.map(
+						_export_document,
+						[self.exporter] * len(tasks),
+						[doc_key for doc_key, _, _ in tasks],
+						[detach_document(document) for _, document, _ in tasks],
+						[path for _, _, path in tasks]
+					))
+			else:
+				for doc_key, document, path in tasks:
+					_export_document(self.exporter, doc_key, document, path)
+
+		# write to a temporary file first, so an interrupted run keeps the previous manifest
+		if tasks or removed_paths:
+			with open(manifest_path + '.tmp', 'w', encoding='utf8') as file:
+				json.dump(manifest, file, indent=4, sort_keys=True)
+			os.replace(manifest_path + '.tmp', manifest_path)
+		return [path for _, _, path in tasks], removed_paths
+
+	def watch(self, path, output_dir, interval=1., polls=None):
+		'''Polls a clippings file and re-exports the documents which changed since the previous poll.
+
+		Only clippings appended to the file are parsed. Each document is exported to its own file in the
+		output directory, so files of unchanged documents are never rewritten. If the previously parsed
+		part of the file changes (i.e. its hash), it is parsed from scratch and files of documents which
+		are gone are removed. Polls during which the file can't be accessed are skipped. Runs until
+		interrupted or for a number of polls.
+		'''
+		documents, offset, digest, file_state = {}, 0, None, None
+		num_polls = 0
+		while (polls is None) or (num_polls < polls):
+			if num_polls > 0:
+				time.sleep(interval)
+			num_polls += 1
+			# skip polls while the file is unavailable (e.g. while the Kindle is unmounted), keeping the parsed state
+			try:
+				stat = os.stat(path)
+			except OSError as err:
+				if self.verbose: print(f"Watch:\n  Could not access '{path}' ({err}). Retrying.")
+				continue
+			# skip files which weren't modified since the previous poll
+			if (stat.st_size, stat.st_mtime_ns) == file_state:
+				continue
+			file_state = (stat.st_size, stat.st_mtime_ns)
+
+			# parse from scratch if the previously parsed part has changed
+			hasher = hash_file_range(path, 0, offset) if offset <= stat.st_size else None
+			from_scratch = (hasher is None) or (hasher.digest() != digest)
+			if from_scratch:
+				if (offset > 0) and self.verbose: print(f"Watch:\n  '{path}' changed before byte {offset}. Parsing from scratch.")
+				documents, offset, hasher = {}, 0, hashlib.sha256()
+			changed_doc_keys = set()
+			start_offset = offset
+			with self.profiler.stage('parse') as record:
+				for offset, doc_key, clipping in self.parser.iter_records(path, start_offset):
+					add_to_documents(documents, doc_key, clipping)
+					changed_doc_keys.add(doc_key)
+					record['items'] += 1
+			digest = hash_file_range(path, start_offset, offset, hasher=hasher).digest()
+			if not (changed_doc_keys or from_scratch):
+				continue
+
+			# process copies of changed documents, so that the parsed clippings can be extended later
+			changed_documents = {}
+			for doc_key in changed_doc_keys:
+				changed_documents[doc_key] = Document(*doc_key)
+				for clipping in documents[doc_key].get_clippings():
+					changed_documents[doc_key].add_clipping(clipping)
+			changed_documents = self.filter(self.postprocess(changed_documents))
+			# after parsing from scratch, files of documents which are gone from the clippings file are removed
+			output_paths, removed_paths = self.export_documents(changed_documents, output_dir, doc_keys=list(documents) if from_scratch else None)
+			if self.verbose:
+				print("Watch:\n  Updated %d document%s:" % (len(output_paths), '' if len(output_paths) == 1 else 's'))
+				for output_path in output_paths:
+					print(f"    '{output_path}'")
+				if removed_paths:
+					print("  Removed %d document%s:" % (len(removed_paths), '' if len(removed_paths) == 1 else 's'))
+					for removed_path in removed_paths:
+						print(f"    '{removed_path}'")
+
+	def select_clippings(self, path):
+		'''Lazily parses only the clippings of a file (or a list of files) which contain the words of the content filters.
+
+		The index of each file is built or updated first and the clippings containing all required words
+		(see get_required_tokens) are read directly at their offsets. The filters still need to be applied
+		to the selected clippings (e.g. to match phrases). Clippings can't be selected if they are merged,
+		as merged clippings are matched across the contents of multiple clippings.
+
+		Returns:
+			tuple: (generator: (('title', 'author'), Clipping), ..., [('title', 'author'), ...] of all documents in order of appearance) or None if no index is used
+		'''
+		tokens = get_required_tokens(self.filters)
+		if (not self.index) or self.merge or (not tokens):
+			return None
+		paths = [path] if isinstance(path, str) else path
+		selections, doc_keys = [], {}
+		with self.profiler.stage('index') as record:
+			for file_path in paths:
+				index = update_index(file_path, self.parser, verbose=self.verbose)
+				clip_ids = index.search(tokens)
+				selections.append((file_path, clip_ids))
+				doc_keys.update(dict.fromkeys(index.doc_keys))
+				record['items'] += len(clip_ids)
+				if self.verbose: print(f"Index:\n  Selected {len(clip_ids)} of {index.count} clippings in '{file_path}'.")
+		files_clippings = (
+			((doc_key, clipping) for _, doc_key, clipping in self.parser.iter_records_at(file_path, clip_ids))
+			for file_path, clip_ids in selections
+		)
+		# identical clippings in multiple files are only added once
+		if len(paths) > 1:
+			return iter_unique_clippings(files_clippings), list(doc_keys)
+		return (clipping for clippings in files_clippings for clipping in clippings), list(doc_keys)
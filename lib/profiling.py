@@ -0,0 +1,155 @@
+import contextlib, functools, sys, time, tracemalloc
+
+from collections import OrderedDict
+
+from lib.data import *
+from lib.exporters import *
+
+# functions which are instrumented by default (owner, function name)
+PROFILED_FUNCTIONS = [
+	(Document, 'merge_clippings'),
+	(Clipping, 'subsumes'),
+	(PdfMergeExporter, '_search_page')
+]
+
+class Profiler:
+	'''Records wall time, CPU time, memory and item counts of pipeline stages and instrumented functions.
+
+	Stages are measured using the stage() context manager. While the profiler is active (i.e. within
+	a with-block), instrumented functions additionally record their number of calls and cumulative
+	time and a cProfile is written to pstats_path if specified. Peak memory is only measured if
+	trace_memory is set, as tracing allocations slows down allocation-heavy stages considerably. A
+	disabled profiler measures nothing, so stages can be declared unconditionally.
+	'''
+	def __init__(self, enabled=True, pstats_path=None, functions=PROFILED_FUNCTIONS, trace_memory=False):
+		self.enabled = enabled
+		self.pstats_path = pstats_path
+		self.trace_memory = enabled and trace_memory
+		self.functions = functions if enabled else []
+		self.stages = OrderedDict() # {'stage': {'wall': float, 'cpu': float, 'peak_bytes': int, 'blocks': int, 'items': int}}
+		self.calls = OrderedDict() # {'Owner.function': {'calls': int, 'wall': float}}
+		self.hooks = []
+		# internal housekeeping
+		self._originals = []
+		self._cprofile = None
+
+	def __repr__(self):
+		return f"<Profiler: {len(self.stages)} stages, {len(self.calls)} functions{'' if self.enabled else ' (disabled)'}>"
+
+	def __enter__(self):
+		if not self.enabled:
+			return self
+		if self.trace_memory:
+			tracemalloc.start()
+		for owner, name in self.functions:
+			self.instrument(owner, name)
+		if self.pstats_path:
+			import cProfile
+			self._cprofile = cProfile.Profile()
+			self._cprofile.enable()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if not self.enabled:
+			return
+		if self._cprofile is not None:
+			self._cprofile.disable()
+			self._cprofile.dump_stats(self.pstats_path)
+			self._cprofile = None
+		self.restore()
+		if self.trace_memory:
+			tracemalloc.stop()
+
+	def add_hook(self, hook):
+		'''Adds a function hook(stage, record) which is called whenever a stage is completed.'''
+		self.hooks.append(hook)
+
+	@contextlib.contextmanager
+	def stage(self, name):
+		'''Measures a stage of the pipeline.
+
+		The yielded record's 'items' can be set (or incremented) to count the items processed in the stage.
+		Blocks are the net change in allocated memory blocks during the stage. Peak bytes are only measured
+		while memory is traced (and 0 otherwise).
+
+		Returns:
+			dict: {'wall': float, 'cpu': float, 'peak_bytes': int, 'blocks': int, 'items': int}
+		'''
+		record = {'wall': 0., 'cpu': 0., 'peak_bytes': 0, 'blocks': 0, 'items': 0}
+		if not self.enabled:
+			yield record
+			return
+		start_bytes = 0
+		if tracemalloc.is_tracing():
+			tracemalloc.reset_peak()
+			start_bytes = tracemalloc.get_traced_memory()[0]
+		start_blocks = sys.getallocatedblocks()
+		start_wall, start_cpu = time.perf_counter(), time.process_time()
+		try:
+			yield record
+		finally:
+			record['wall'] = time.perf_counter() - start_wall
+			record['cpu'] = time.process_time() - start_cpu
+			record['blocks'] = sys.getallocatedblocks() - start_blocks
+			if tracemalloc.is_tracing():
+				# peak memory allocated in addition to the memory in use at the start of the stage
+				record['peak_bytes'] = tracemalloc.get_traced_memory()[1] - start_bytes
+			self.stages[name] = record
+			for hook in self.hooks:
+				hook(name, record)
+
+	def iter_counted(self, items, record):
+		# count items of a stream as they pass through a stage
+		for item in items:
+			record['items'] += 1
+			yield item
+
+	def instrument(self, owner, name):
+		'''Replaces a function of a class or module with a wrapper recording its calls and cumulative time.
+
+		Calls within worker processes (e.g. when using multiple jobs) are not recorded.
+		'''
+		function = getattr(owner, name)
+		key = f'{owner.__name__}.{name}'
+		stats = self.calls.setdefault(key, {'calls': 0, 'wall': 0.})
+
+		@functools.wraps(function)
+		def wrapper(*args, **kwargs):
+			start_wall = time.perf_counter()
+			try:
+				return function(*args, **kwargs)
+			finally:
+				stats['calls'] += 1
+				stats['wall'] += time.perf_counter() - start_wall
+
+		self._originals.append((owner, name, function))
+		setattr(owner, name, wrapper)
+
+	def restore(self):
+		# restore instrumented functions in reverse order
+		for owner, name, function in reversed(self._originals):
+			setattr(owner, name, function)
+		self._originals = []
+
+	def report(self):
+		'''Summarizes all measurements in the style of the verbose CLI output.
+
+		Time of instrumented functions is inclusive, i.e. includes nested (and recursive) calls.
+
+		Returns:
+			str: report
+		'''
+		lines = ["Profile (%d stages%s):" % (len(self.stages), ', memory traced' if self.trace_memory else '')]
+		for name, record in self.stages.items():
+			peak = ' %8.1f MB peak' % (record['peak_bytes'] / (1 << 20)) if self.trace_memory else ''
+			lines.append("  %-8s %8.3fs wall %8.3fs CPU%s %+10d blocks %9d items" % (
+				name, record['wall'], record['cpu'], peak, record['blocks'], record['items']
+			))
+		called = [(key, stats) for key, stats in self.calls.items() if stats['calls'] > 0]
+		if called:
+			lines.append("  Functions (%d called):" % len(called))
+			for key, stats in called:
+				lines.append("    %s: %d calls, %.3fs" % (key, stats['calls'], stats['wall']))
+		if self.pstats_path:
+			lines.append(f"  cProfile statistics were saved to '{self.pstats_path}'.")
+		return '\n'.join(lines)
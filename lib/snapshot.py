@@ -0,0 +1,170 @@
+import datetime, os, struct, sys
+
+from array import array
+
+from lib.data import *
+
+SNAPSHOT_MAGIC = b'CHOKITTO'
+SNAPSHOT_VERSION = 1
+# magic, version, source size, source mtime (ns), parsed offset, SHA-256 of parsed prefix
+SNAPSHOT_HEADER = struct.Struct('<8sHqqq32s')
+# sentinel for missing integer values (e.g. clippings without page)
+NONE_VALUE = -(1 << 63)
+DATETIME_EPOCH = datetime.datetime(1, 1, 1)
+
+#
+# columnar I/O helpers
+#
+
+def write_column(fp, values):
+	column = array('q', values)
+	# store columns as little-endian independent of the platform
+	if sys.byteorder == 'big':
+		column.byteswap()
+	fp.write(struct.pack('<Q', len(column)))
+	fp.write(column.tobytes())
+
+def read_column(fp):
+	length, = struct.unpack('<Q', fp.read(8))
+	column = array('q')
+	column.frombytes(fp.read(length * column.itemsize))
+	if len(column) != length:
+		raise ValueError("Snapshot is truncated.")
+	if sys.byteorder == 'big':
+		column.byteswap()
+	return column
+
+def write_strings(fp, strings):
+	# store strings as offsets into a single UTF-8 blob
+	encoded = [string.encode('utf8') for string in strings]
+	string_offsets = [0]
+	for string in encoded:
+		string_offsets.append(string_offsets[-1] + len(string))
+	write_column(fp, string_offsets)
+	fp.write(b''.join(encoded))
+
+def read_strings(fp):
+	string_offsets = read_column(fp)
+	blob = fp.read(string_offsets[-1])
+	if len(blob) != string_offsets[-1]:
+		raise ValueError("Snapshot is truncated.")
+	return [blob[start:end].decode('utf8') for start, end in zip(string_offsets, string_offsets[1:])]
+
+def _to_seconds(date_time):
+	if date_time is None:
+		return NONE_VALUE
+	delta = date_time - DATETIME_EPOCH
+	return delta.days * 86400 + delta.seconds
+
+def _from_seconds(seconds):
+	if seconds == NONE_VALUE:
+		return None
+	return DATETIME_EPOCH + datetime.timedelta(seconds=seconds)
+
+#
+# snapshot I/O
+#
+
+def save_snapshot(path, documents, source=None):
+	'''Stores documents and their clippings in a compact, columnar binary format.
+
+	Strings (titles, authors, types and contents) are stored once in a string table, all other fields as
+	integer columns with one row per clipping. Merged clippings reference their parent row.
+
+	Args:
+		source (dict): {'size': int, 'mtime_ns': int, 'offset': int, 'digest': bytes} of the parsed file
+	'''
+	source = source or {}
+	strings, string_idcs = [], {}
+	def get_string_idx(string):
+		if string is None:
+			return NONE_VALUE
+		if string not in string_idcs:
+			string_idcs[string] = len(strings)
+			strings.append(string)
+		return string_idcs[string]
+
+	doc_titles, doc_authors = [], []
+	columns = {name: [] for name in ['document', 'parent', 'type', 'page_start', 'page_end', 'location_start', 'location_end', 'datetime', 'content']}
+	def add_row(doc_idx, parent_idx, clipping):
+		row_idx = len(columns['document'])
+		columns['document'].append(doc_idx)
+		columns['parent'].append(parent_idx)
+		columns['type'].append(get_string_idx(clipping.clip_type))
+		columns['page_start'].append(clipping.page[0] if clipping.page else NONE_VALUE)
+		columns['page_end'].append(clipping.page[1] if clipping.page else NONE_VALUE)
+		columns['location_start'].append(clipping.location[0] if clipping.location else NONE_VALUE)
+		columns['location_end'].append(clipping.location[1] if clipping.location else NONE_VALUE)
+		columns['datetime'].append(_to_seconds(clipping.datetime))
+		columns['content'].append(NONE_VALUE if clipping.is_merged() else get_string_idx(clipping.content))
+		# store merged contents as rows referencing the merged clipping
+		if clipping.is_merged():
+			for content in clipping.content:
+				add_row(doc_idx, row_idx, content)
+
+	for doc_idx, document in enumerate(documents.values()):
+		doc_titles.append(get_string_idx(document.title))
+		doc_authors.append(get_string_idx(document.author))
+		for clipping in document.get_clippings():
+			add_row(doc_idx, NONE_VALUE, clipping)
+
+	with open(path + '.tmp', 'wb') as fp:
+		fp.write(SNAPSHOT_HEADER.pack(
+			SNAPSHOT_MAGIC, SNAPSHOT_VERSION,
+			source.get('size', -1), source.get('mtime_ns', -1), source.get('offset', -1),
+			source.get('digest', bytes(32))
+		))
+		write_strings(fp, strings)
+		write_column(fp, doc_titles)
+		write_column(fp, doc_authors)
+		for name in columns:
+			write_column(fp, columns[name])
+	# replace previous snapshot only once the new one is complete
+	os.replace(path + '.tmp', path)
+
+def load_snapshot(path):
+	'''Loads documents stored using save_snapshot.
+
+	Returns:
+		tuple: ({('title', 'author'): Document, ...}, {'size': int, 'mtime_ns': int, 'offset': int, 'digest': bytes})
+
+	Raises:
+		ValueError: if the file is not a (compatible) snapshot
+	'''
+	with open(path, 'rb') as fp:
+		header = fp.read(SNAPSHOT_HEADER.size)
+		if len(header) != SNAPSHOT_HEADER.size:
+			raise ValueError(f"'{path}' is not a snapshot.")
+		magic, version, size, mtime_ns, offset, digest = SNAPSHOT_HEADER.unpack(header)
+		if (magic != SNAPSHOT_MAGIC) or (version != SNAPSHOT_VERSION):
+			raise ValueError(f"'{path}' is not a snapshot of version {SNAPSHOT_VERSION}.")
+		strings = read_strings(fp)
+		doc_titles, doc_authors = read_column(fp), read_column(fp)
+		columns = [read_column(fp) for _ in range(9)]
+
+	def get_string(string_idx):
+		return None if string_idx == NONE_VALUE else strings[string_idx]
+
+	documents = {}
+	document_list = []
+	for title_idx, author_idx in zip(doc_titles, doc_authors):
+		document = Document(get_string(title_idx), get_string(author_idx))
+		documents[(document.title, document.author)] = document
+		document_list.append(document)
+
+	rows = []
+	for doc_idx, parent_idx, type_idx, page_start, page_end, location_start, location_end, seconds, content_idx in zip(*columns):
+		clipping = Clipping(
+			page=None if page_start == NONE_VALUE else (page_start, page_end),
+			location=None if location_start == NONE_VALUE else (location_start, location_end),
+			datetime=_from_seconds(seconds),
+			content=[] if content_idx == NONE_VALUE else strings[content_idx],
+			clip_type=strings[type_idx]
+		)
+		rows.append(clipping)
+		if parent_idx == NONE_VALUE:
+			document_list[doc_idx].add_clipping(clipping)
+		else:
+			rows[parent_idx].content.append(clipping)
+
+	return documents, {'size': size, 'mtime_ns': mtime_ns, 'offset': offset, 'digest': digest}
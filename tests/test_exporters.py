@@ -0,0 +1,82 @@
+import io, json, os, sqlite3, subprocess, sys, unittest
+
+from lib.pipeline import *
+from tests.utils import *
+
+
+class JsonlExporterTest(ClippingsTestCase):
+	def setUp(self):
+		super().setUp()
+		# clippings of both documents are interleaved and not sorted by position
+		self.write(''.join([
+			format_clipping('Book B', 'Second highlight.', 20),
+			format_clipping('Book A', 'First highlight.', 10),
+			format_clipping('Book B', 'Earlier highlight.', 5),
+			format_clipping('Book A', 'A note.', 10, clip_type='Note')
+		]))
+
+	def export(self, streaming, filters=None):
+		pipeline = Pipeline(exporter='jsonl', filters=filters)
+		output, doc_keys = io.StringIO(), []
+		if streaming:
+			source = pipeline.iter_clippings(self.path, doc_keys=doc_keys)
+		else:
+			source = pipeline.get_documents(self.path)
+		pipeline.export(source, output, doc_keys=doc_keys)
+		return output.getvalue()
+
+	def test_streamed_output_matches_documents(self):
+		for filters in [None, ["type('highlight')"]]:
+			self.assertEqual(self.export(streaming=True, filters=filters), self.export(streaming=False, filters=filters), filters)
+
+	def test_cli_output(self):
+		# without and with an option which requires documents to be collected
+		outputs = []
+		for options in [[], ['-c', os.path.join(self.tmp_dir.name, 'clippings.checkpoint')]]:
+			result = subprocess.run(
+				[sys.executable, 'chokitto.py', self.path, '-e', 'jsonl'] + options,
+				cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), capture_output=True, check=True, text=True
+			)
+			outputs.append(result.stdout)
+		self.assertEqual(outputs[0], outputs[1])
+		self.assertEqual(outputs[0], self.export(streaming=False))
+		# every line is a JSON object, without an empty line at the end
+		self.assertEqual([json.loads(line)['title'] for line in outputs[0].splitlines()], ['Book B', 'Book B', 'Book A', 'Book A'])
+
+
+class SqliteExporterTest(ClippingsTestCase):
+	def setUp(self):
+		super().setUp()
+		self.db_path = os.path.join(self.tmp_dir.name, 'clippings.db')
+
+	def export(self, merge=False):
+		Pipeline(exporter='sqlite', merge=merge).run(self.path, self.db_path)
+		connection = sqlite3.connect(self.db_path)
+		try:
+			clippings = connection.execute('SELECT type, location_start, content, merged FROM clippings ORDER BY id').fetchall()
+			members = connection.execute('SELECT type, content FROM clipping_members ORDER BY clipping_id, position').fetchall()
+			orphans = connection.execute('SELECT COUNT(*) FROM clipping_members WHERE clipping_id IS NULL OR clipping_id NOT IN (SELECT id FROM clippings)').fetchone()[0]
+		finally:
+			connection.close()
+		return clippings, members, orphans
+
+	def test_merged_note_replaces_highlight(self):
+		self.write(format_clipping('Book A', 'First highlight.', 10))
+		self.assertEqual(self.export(merge=True), ([('highlight', 10, 'First highlight.', 0)], [], 0))
+		# a note is added to the highlight in the meantime
+		self.write(format_clipping('Book A', 'First highlight.', 10) + format_clipping('Book A', 'A note.', 10, clip_type='Note'))
+		expected = ([('highlight+note', 10, None, 1)], [('highlight', 'First highlight.'), ('note', 'A note.')], 0)
+		self.assertEqual(self.export(merge=True), expected)
+		# exporting again doesn't change the database
+		self.assertEqual(self.export(merge=True), expected)
+
+	def test_appended_note_is_inserted(self):
+		self.write(format_clipping('Book A', 'First highlight.', 10))
+		self.assertEqual(self.export(), ([('highlight', 10, 'First highlight.', 0)], [], 0))
+		self.write(format_clipping('Book A', 'First highlight.', 10) + format_clipping('Book A', 'A note.', 10, clip_type='Note'))
+		expected = ([('highlight', 10, 'First highlight.', 0), ('note', 10, 'A note.', 0)], [], 0)
+		self.assertEqual(self.export(), expected)
+		self.assertEqual(self.export(), expected)
+
+if __name__ == '__main__':
+	unittest.main()
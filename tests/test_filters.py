@@ -0,0 +1,84 @@
+import unittest
+
+from unittest import mock
+
+from lib.filters import *
+
+def describe(expression):
+	# nested tuples of filter classes and their arguments, e.g. ('OrFilter', ('TitleFilter', 'a', 'exact'), ...)
+	if isinstance(expression, BooleanFilter):
+		return (type(expression).__name__, ) + tuple(describe(operand) for operand in expression.operands)
+	if isinstance(expression, ComparisonFilter):
+		return (type(expression).__name__, str(expression.reference))
+	return (type(expression).__name__, expression.match, expression.mode)
+
+
+class FilterExpressionTest(unittest.TestCase):
+	def assertParses(self, filter_str, expected):
+		self.assertEqual(describe(parse_filter_expression(filter_str)), expected, filter_str)
+
+	def test_precedence(self):
+		# 'and' binds more strongly than 'or', 'not' more strongly than 'and'
+		self.assertParses(
+			"title('a') or type('b') and content('c')",
+			('OrFilter', ('TitleFilter', 'a', 'exact'), ('AndFilter', ('TypeFilter', 'b', 'exact'), ('ContentFilter', 'c', 'phrase')))
+		)
+		self.assertParses(
+			"not title('a') AND type('b')",
+			('AndFilter', ('NotFilter', ('TitleFilter', 'a', 'exact')), ('TypeFilter', 'b', 'exact'))
+		)
+
+	def test_parentheses(self):
+		self.assertParses(
+			"(title('a') or type('b')) and content('c')",
+			('AndFilter', ('OrFilter', ('TitleFilter', 'a', 'exact'), ('TypeFilter', 'b', 'exact')), ('ContentFilter', 'c', 'phrase'))
+		)
+		self.assertParses(
+			" ( ( title('a') ) or ( author('b') and (type('c')) ) ) ",
+			('OrFilter', ('TitleFilter', 'a', 'exact'), ('AndFilter', ('AuthorFilter', 'b', 'exact'), ('TypeFilter', 'c', 'exact')))
+		)
+
+	def test_not(self):
+		self.assertParses("not(type('note'))", ('NotFilter', ('TypeFilter', 'note', 'exact')))
+		self.assertParses(
+			"title('a') and not (type('note') or after('2020-01-01 00:00:00'))",
+			('AndFilter', ('TitleFilter', 'a', 'exact'), ('NotFilter', ('OrFilter', ('TypeFilter', 'note', 'exact'), ('AfterFilter', '2020-01-01 00:00:00'))))
+		)
+		self.assertParses("not not type('note')", ('NotFilter', ('NotFilter', ('TypeFilter', 'note', 'exact'))))
+
+	def test_arguments(self):
+		self.assertParses("content('a, b', 'regex')", ('ContentFilter', 'a, b', 'regex'))
+		self.assertParses("content( 'a) or (b' ,'all' )", ('ContentFilter', 'a) or (b', 'all'))
+		self.assertParses("title('It's a Title')", ('TitleFilter', "It's a Title", 'exact'))
+		self.assertParses("title('Book No \\d+', 'regex')", ('TitleFilter', 'Book No \\d+', 'regex'))
+
+	def test_malformed(self):
+		for filter_str, column in [
+			("type ('note')", 5),
+			("type('note'", 6),
+			("type(note)", 6),
+			("(type('note')", 14),
+			("type('note'))", 13),
+			("type('note') title('a')", 14),
+			("type('note') and", 17),
+			# keywords are only matched as separate words
+			("type('note') orauthor('a')", 14),
+			("not", 4),
+			("", 1)
+		]:
+			with self.assertRaisesRegex(ValueError, f'at column {column} ', msg=filter_str):
+				parse_filter_expression(filter_str)
+
+	def test_filters_without_arguments(self):
+		# filters whose arguments are left at their defaults may omit the parentheses (none of the current filters can)
+		with mock.patch.dict(FILTER_MAP, {'highlight': lambda mode='exact': TypeFilter('highlight', mode)}):
+			self.assertParses('highlight', ('TypeFilter', 'highlight', 'exact'))
+			self.assertParses("not highlight and highlight('regex')", ('AndFilter', ('NotFilter', ('TypeFilter', 'highlight', 'exact')), ('TypeFilter', 'highlight', 'regex')))
+
+	def test_invalid_filters(self):
+		for filter_str in ["unknown('a')", "type()", "type('a', 'fuzzy')"]:
+			with self.assertRaises((ValueError, AssertionError), msg=filter_str):
+				parse_filter_expression(filter_str)
+
+if __name__ == '__main__':
+	unittest.main()
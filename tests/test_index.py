@@ -0,0 +1,28 @@
+import os, unittest
+
+from lib.index import *
+from lib.parsers import *
+from tests.utils import *
+
+
+class IndexUpdateTest(ClippingsTestCase):
+	def test_update_after_incomplete_separator(self):
+		for parser_class in PARSER_MAP.values():
+			index_path = os.path.join(self.tmp_dir.name, parser_class.__name__ + '.index')
+			parser = parser_class()
+			self.write(self.complete[:-2])
+			index = update_index(self.path, parser, index_path=index_path)
+			self.assertEqual(index.count, 1, parser_class.__name__)
+			# the Kindle finishes writing the separator and appends another clipping
+			self.write(self.complete + format_clipping('Book C', 'Third highlight.', 3))
+			index = update_index(self.path, parser, index_path=index_path)
+			self.assertEqual(index.count, 3, parser_class.__name__)
+			records = list(parser.iter_records_at(self.path, index.search(['highlight'])))
+			self.assertEqual(
+				[(doc_key[0], clipping.content) for _, doc_key, clipping in records],
+				[('Book A', 'First highlight.'), ('Book B', 'Second highlight.'), ('Book C', 'Third highlight.')],
+				parser_class.__name__
+			)
+
+if __name__ == '__main__':
+	unittest.main()
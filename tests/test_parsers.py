@@ -0,0 +1,85 @@
+import os, unittest
+
+from lib.parsers import *
+from tests.utils import *
+
+
+class KindleDatetimeTest(unittest.TestCase):
+	'''parse_kindle_datetime produces the same results as strptime.'''
+	def format(self, date_time, pad_day=False, pad_hour=False):
+		hour = date_time.hour % 12 or 12
+		return 'Added on %s, %s %s, %d %s:%02d:%02d %s' % (
+			date_time.strftime('%A'), date_time.strftime('%B'), ('%02d' if pad_day else '%d') % date_time.day, date_time.year,
+			('%02d' if pad_hour else '%d') % hour, date_time.minute, date_time.second, 'AM' if date_time.hour < 12 else 'PM'
+		)
+
+	def assertMatchesStrptime(self, datetime_str):
+		try:
+			expected = datetime.datetime.strptime(datetime_str, KINDLE_DATETIME_FORMAT)
+		except ValueError:
+			with self.assertRaises(ValueError, msg=datetime_str):
+				parse_kindle_datetime(datetime_str)
+			return
+		self.assertEqual(parse_kindle_datetime(datetime_str), expected, datetime_str)
+
+	def test_valid_datetimes(self):
+		# every hour of every day in a leap year, covering all months, padded and unpadded days and hours, AM/PM and 12 o'clock
+		date_time = datetime.datetime(2020, 1, 1, 0, 0, 0)
+		while date_time.year == 2020:
+			for pad_day in (False, True):
+				for pad_hour in (False, True):
+					datetime_str = self.format(date_time, pad_day=pad_day, pad_hour=pad_hour)
+					self.assertEqual(parse_kindle_datetime(datetime_str), date_time, datetime_str)
+					self.assertMatchesStrptime(datetime_str)
+			date_time += datetime.timedelta(hours=1, minutes=7, seconds=13)
+
+	def test_invalid_datetimes(self):
+		for datetime_str in [
+			'Added on Monday, January 6, 2020 0:13:17 AM',
+			'Added on Monday, January 6, 2020 13:13:17 PM',
+			'Added on Monday, January 6, 2020 10:60:17 PM',
+			'Added on Monday, January 6, 2020 10:13:17',
+			'Added on Monday, February 30, 2020 10:13:17 PM',
+			'Added on Monday, Jan 6, 2020 10:13:17 PM',
+			'Added on Mon, January 6, 2020 10:13:17 PM',
+			'Added on Monday, January 006, 2020 10:13:17 PM',
+			'Added on Monday, January 6, 20 10:13:17 PM',
+			'Added on Monday, january 6, 2020 10:13:17 pm',
+			'Added on Monday, January 6, 2020 010:13:17 PM',
+			'Added Monday, January 6, 2020 10:13:17 PM'
+		]:
+			self.assertMatchesStrptime(datetime_str)
+
+
+class TruncatedSeparatorTest(ClippingsTestCase):
+	'''Clippings files which end in a separator without line break (e.g. while the Kindle is writing to them).'''
+	def setUp(self):
+		super().setUp()
+		self.checkpoint = os.path.join(self.tmp_dir.name, 'clippings.checkpoint')
+
+	def test_incomplete_separator_is_not_yielded(self):
+		self.write(self.complete[:-2])
+		for parser_class in PARSER_MAP.values():
+			records = list(parser_class()._iter_range(self.path))
+			self.assertEqual([doc_key for _, doc_key, _ in records], [('Book A', 'Lastname, Name')], parser_class.__name__)
+			self.assertEqual(records[0][0], len(format_clipping('Book A', 'First highlight.', 1).encode('utf8')), parser_class.__name__)
+
+	def test_checkpoint_resume_after_incomplete_separator(self):
+		for parser_class in PARSER_MAP.values():
+			if os.path.exists(self.checkpoint):
+				os.remove(self.checkpoint)
+			self.write(self.complete[:-2])
+			documents = parser_class().parse(self.path, checkpoint=self.checkpoint)
+			self.assertEqual(sorted(documents), [('Book A', 'Lastname, Name')], parser_class.__name__)
+			# the Kindle finishes writing the separator and appends another clipping
+			self.write(self.complete + format_clipping('Book C', 'Third highlight.', 3))
+			documents = parser_class().parse(self.path, checkpoint=self.checkpoint)
+			self.assertEqual(
+				sorted(documents),
+				[('Book A', 'Lastname, Name'), ('Book B', 'Lastname, Name'), ('Book C', 'Lastname, Name')],
+				parser_class.__name__
+			)
+			self.assertEqual(documents[('Book B', 'Lastname, Name')].clippings[0].content, 'Second highlight.', parser_class.__name__)
+
+if __name__ == '__main__':
+	unittest.main()
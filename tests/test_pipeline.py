@@ -0,0 +1,99 @@
+import os, tempfile, unittest
+
+from unittest import mock
+
+from lib.pipeline import *
+from tests.utils import *
+
+
+class DocumentFilenameTest(unittest.TestCase):
+	def test_long_titles_are_truncated_by_bytes(self):
+		for title in ['本' * 96, 'ä' * 300, 'a' * 300]:
+			filename = get_document_filename((title, 'Lastname, Name'), '.md')
+			self.assertLessEqual(len(filename.encode('utf8')), FILENAME_MAX_BYTES - FILENAME_NUMBER_BYTES)
+			self.assertTrue(filename.startswith(title[:10]) and filename.endswith('.md'))
+			numbered = get_document_filename((title, 'Lastname, Name'), '.md', taken={filename.lower()})
+			self.assertLessEqual(len(numbered.encode('utf8')), FILENAME_MAX_BYTES)
+
+	def test_long_titles_can_be_written(self):
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			path = os.path.join(tmp_dir, get_document_filename(('本' * 96, None), '.md'))
+			with open(path, 'w', encoding='utf8') as fp:
+				fp.write('')
+			self.assertTrue(os.path.exists(path))
+
+
+class MultipleFilesTest(ClippingsTestCase):
+	def setUp(self):
+		super().setUp()
+		self.paths = [os.path.join(self.tmp_dir.name, f'clippings{idx}.txt') for idx in range(2)]
+		# both files contain a duplicate clipping and share another clipping
+		clippings = [format_clipping('Book A', 'First highlight.', 1), format_clipping('Book A', 'Second highlight.', 2)]
+		for path, data in zip(self.paths, [clippings[0] * 2 + clippings[1], clippings[1] * 2]):
+			self.write(data, path)
+
+	def get_contents(self, path, **kwargs):
+		documents = Pipeline(**kwargs).get_documents(path)
+		return [clipping.content for document in documents.values() for clipping in document.get_clippings()]
+
+	def test_duplicates_across_files_are_removed(self):
+		expected = ['First highlight.', 'First highlight.', 'Second highlight.']
+		self.assertEqual(self.get_contents(self.paths[0]), expected)
+		self.assertEqual(self.get_contents(self.paths[:1]), expected)
+		self.assertEqual(self.get_contents(self.paths), expected)
+		self.assertEqual(self.get_contents(self.paths, jobs=2), expected)
+		self.assertEqual(self.get_contents(self.paths, index=True, filters=["content('highlight')"]), expected)
+		self.assertEqual(self.get_contents(self.paths, dedup=True), ['First highlight.', 'Second highlight.'])
+
+
+class ExportDocumentsTest(ClippingsTestCase):
+	def export(self, filters=None):
+		pipeline = Pipeline(filters=filters)
+		doc_keys = []
+		documents = pipeline.get_documents(self.path, doc_keys=doc_keys)
+		return pipeline.export_documents(documents, self.output_dir, doc_keys=doc_keys)
+
+	def test_filtered_documents_are_kept(self):
+		self.write(self.complete)
+		output_paths, _ = self.export()
+		self.assertEqual(len(output_paths), 2)
+		_, removed_paths = self.export(filters=["title('nomatch')"])
+		self.assertEqual(removed_paths, [])
+		self.assertTrue(all(os.path.exists(output_path) for output_path in output_paths))
+
+	def test_removed_documents_are_deleted(self):
+		self.write(self.complete)
+		self.export()
+		self.write(format_clipping('Book A', 'First highlight.', 1))
+		_, removed_paths = self.export()
+		self.assertEqual([os.path.basename(path) for path in removed_paths], ['Book B (Lastname, Name).md'])
+		self.assertFalse(os.path.exists(removed_paths[0]))
+
+
+class WatchTest(ClippingsTestCase):
+	def read_output(self, title):
+		with open(os.path.join(self.output_dir, f'{title} (Lastname, Name).md'), encoding='utf8') as fp:
+			return fp.read()
+
+	def test_incomplete_separator(self):
+		for parser in PARSER_MAP:
+			self.write(self.complete[:-2])
+			with mock.patch('time.sleep', side_effect=lambda _: self.write(self.complete + format_clipping('Book C', 'Third highlight.', 3))):
+				Pipeline(parser=parser).watch(self.path, self.output_dir, polls=2)
+			self.assertIn('Second highlight.', self.read_output('Book B'), parser)
+			self.assertIn('Third highlight.', self.read_output('Book C'), parser)
+
+	def test_unavailable_file(self):
+		self.write(self.complete)
+		# the file is removed and restored with an appended clipping between polls
+		updates = iter([
+			lambda: os.remove(self.path),
+			lambda: self.write(self.complete + format_clipping('Book C', 'Third highlight.', 3))
+		])
+		with mock.patch('time.sleep', side_effect=lambda _: next(updates)()):
+			Pipeline().watch(self.path, self.output_dir, polls=3)
+		self.assertIn('Second highlight.', self.read_output('Book B'))
+		self.assertIn('Third highlight.', self.read_output('Book C'))
+
+if __name__ == '__main__':
+	unittest.main()
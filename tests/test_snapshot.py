@@ -0,0 +1,55 @@
+import datetime, os, unittest
+
+from lib.snapshot import *
+from tests.utils import *
+
+def describe(clipping):
+	# all fields of a clipping, including the fields of merged contents
+	content = [describe(member) for member in clipping.content] if clipping.is_merged() else clipping.content
+	return (clipping.clip_type, clipping.page, clipping.location, clipping.datetime, content)
+
+
+class SnapshotTest(ClippingsTestCase):
+	def round_trip(self, documents, source=None):
+		snapshot_path = os.path.join(self.tmp_dir.name, 'clippings.checkpoint')
+		save_snapshot(snapshot_path, documents, source=source)
+		return load_snapshot(snapshot_path)
+
+	def assertDocumentsEqual(self, loaded, documents):
+		self.assertEqual(list(loaded), list(documents))
+		for doc_key, document in documents.items():
+			self.assertEqual((loaded[doc_key].title, loaded[doc_key].author), (document.title, document.author))
+			self.assertEqual(
+				[describe(clipping) for clipping in loaded[doc_key].get_clippings()],
+				[describe(clipping) for clipping in document.get_clippings()],
+				doc_key
+			)
+			self.assertEqual(sorted(loaded[doc_key].get_clipping_types()), sorted(document.get_clipping_types()), doc_key)
+
+	def test_round_trip(self):
+		date_time = datetime.datetime(2020, 1, 6, 22, 13, 17)
+		documents = {}
+		# missing author, page, location and datetime
+		add_to_documents(documents, ('Untitled', None), Clipping(None, None, None, 'Content without position.', 'highlight'))
+		add_to_documents(documents, ('Untitled', None), Clipping(None, (1, 1), date_time, '', 'bookmark'))
+		# non-ASCII title, author and contents, and merged clippings
+		add_to_documents(documents, ('チョキっと – Über Notizen', 'Müller, Zoë'), Clipping((3, 4), None, date_time, '«Zitat» mit Ümlauten 📚', 'highlight'))
+		documents[('チョキっと – Über Notizen', 'Müller, Zoë')].add_clipping(Clipping((12, 12), (120, 125), date_time, [
+			Clipping((12, 12), (120, 125), date_time, 'Hervorgehobener Text.', 'highlight'),
+			Clipping((12, 12), (125, 125), datetime.datetime(1, 1, 1), 'Notiz: 注釈', 'note')
+		], 'highlight+note'))
+		# document without clippings
+		documents[('Empty', 'Lastname, Name')] = Document('Empty', 'Lastname, Name')
+
+		source = {'size': 1234, 'mtime_ns': 1578348797000000000, 'offset': 1200, 'digest': bytes(range(32))}
+		loaded, loaded_source = self.round_trip(documents, source=source)
+		self.assertDocumentsEqual(loaded, documents)
+		self.assertEqual(loaded_source, source)
+
+	def test_empty(self):
+		loaded, loaded_source = self.round_trip({})
+		self.assertEqual(loaded, {})
+		self.assertEqual(loaded_source, {'size': -1, 'mtime_ns': -1, 'offset': -1, 'digest': bytes(32)})
+
+if __name__ == '__main__':
+	unittest.main()
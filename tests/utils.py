@@ -0,0 +1,21 @@
+import os, tempfile, unittest
+
+def format_clipping(title, content, location, clip_type='Highlight'):
+	# e.g. a clipping as in Kindle's 'My Clippings.txt'
+	return f'{title} (Lastname, Name)\r\n- Your {clip_type} on Location {location} | Added on Monday, January 6, 2020 10:13:17 PM\r\n\r\n{content}\r\n==========\r\n'
+
+
+class ClippingsTestCase(unittest.TestCase):
+	'''Test case with a temporary directory for a clippings file (path) and exported files (output_dir).'''
+	def setUp(self):
+		self.tmp_dir = tempfile.TemporaryDirectory()
+		self.path = os.path.join(self.tmp_dir.name, 'My Clippings.txt')
+		self.output_dir = os.path.join(self.tmp_dir.name, 'output')
+		self.complete = format_clipping('Book A', 'First highlight.', 1) + format_clipping('Book B', 'Second highlight.', 2)
+
+	def tearDown(self):
+		self.tmp_dir.cleanup()
+
+	def write(self, data, path=None):
+		with open(path or self.path, 'w', encoding='utf8', newline='') as fp:
+			fp.write(data)